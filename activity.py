@@ -0,0 +1,36 @@
+import asyncio
+import logging
+
+from aiogram import BaseMiddleware
+
+from cache import TTLCache
+from database import db_touch_user
+
+logger = logging.getLogger(__name__)
+
+# --- АКТИВНОСТЬ ПОЛЬЗОВАТЕЛЕЙ (users.last_seen_at) ---
+# Outer-middleware апдейтов отмечает последний визит пользователя: по нему
+# работают аудитория рассылок "active N" и возврат в рассылки после разблокировки
+# бота. Пишем в фоне (ответ не ждет) и не чаще раза в TOUCH_INTERVAL на пользователя.
+# Считаются только сообщения и нажатия кнопок: вход в чужой канал (chat_member) —
+# не визит в бота.
+
+TOUCH_INTERVAL = 3600
+
+
+class ActivityMiddleware(BaseMiddleware):
+    def __init__(self):
+        self._touched = TTLCache(ttl=TOUCH_INTERVAL, maxsize=100000)
+        self._tasks = set()     # ссылки на фоновые записи, чтобы их не собрал GC
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is not None and (event.message or event.callback_query) and not self._touched.get(user.id):
+            self._touched.set(user.id, True)
+            task = asyncio.create_task(db_touch_user(user.id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await handler(event, data)
+
+
+activity = ActivityMiddleware()
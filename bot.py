@@ -1,10 +1,23 @@
 import asyncio
 import logging
+import multiprocessing
+import os
+import signal
 from aiogram import Bot, Dispatcher
-from config import TOKEN
+from config import (
+    TOKEN, RUN_MONITOR, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBAPP_HOST, WEBAPP_PORT, WEB_WORKERS, REDIS_URL, API_PROCESSES
+)
 import database # <--- Импортируем модуль целиком
 from database import init_db
+from catalog import task_catalog
 from monitoring import monitor_unsubscribes
+from notifier import notifier
+from broadcast import broadcaster
+from outbound import outbound
+from runtime import runtime
+from activity import activity
+from webhook import UpdateReceiver, build_app, serve
 
 # Импортируем все обработчики
 from handlers.main_menu import register_main_menu_handlers
@@ -21,7 +34,19 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
+# Все исходящие запросы — через планировщик с лимитами Bot API
+bot.session.middleware(outbound)
+
+def create_storage():
+    """FSM в памяти процесса; при нескольких процессах — общее хранилище в Redis."""
+    if not REDIS_URL:
+        return None
+    from aiogram.fsm.storage.redis import RedisStorage
+    return RedisStorage.from_url(REDIS_URL)
+
+dp = Dispatcher(storage=create_storage())
+# Время последнего визита пользователя (users.last_seen_at)
+dp.update.outer_middleware(activity)
 
 # Регистрируем все обработчики
 register_main_menu_handlers(dp, bot)
@@ -31,21 +56,119 @@ register_earn_handlers(dp, bot)
 register_advertise_handlers(dp, bot)
 register_admin_handlers(dp, bot)
 
-async def main():
+async def startup(worker_index=0):
     await init_db()
+    # Данные бота, статичные ссылки, проверка пула — до приема апдейтов
+    await runtime.warm_up(bot)
+
+    # Фоновая отправка уведомлений (штрафы и т.п.)
+    notifier.start(bot)
+    # Рассылки: продолжает брошенные после падения/перезапуска
+    broadcaster.start(bot)
+    # Запускаем фоновый мониторинг отписок (если он не вынесен в monitor_worker.py).
+    # Из нескольких webhook-процессов мониторинг ведет только первый
+    if RUN_MONITOR and worker_index == 0:
+        asyncio.create_task(monitor_unsubscribes(bot))
+
+async def shutdown():
+    await broadcaster.stop()
+    await notifier.stop()
+    await bot.session.close()
+    await dp.storage.close()
+    await task_catalog.stop()
+    # ВАЖНО: Используем database.db_pool для проверки и закрытия
+    if database.db_pool: 
+        await database.db_pool.close()
+
+async def main():
+    # Лимит Bot API общий на токен — делим его с процессами monitor_worker.py
+    outbound.share(API_PROCESSES)
+    await startup()
     await bot.delete_webhook(drop_pending_updates=True)
-    
-    # Запускаем фоновый мониторинг отписок
-    asyncio.create_task(monitor_unsubscribes(bot))
-    
     try:
         logger.info("Bot started (Persistent Menu Mode)")
-        await dp.start_polling(bot)
+        # chat_member приходит только если явно запрошен в allowed_updates
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await shutdown()
+
+# --- РЕЖИМ WEBHOOK ---
+async def set_webhook():
+    """Один раз на запуск (в главном процессе), не в каждом воркере."""
+    if not WEBHOOK_URL:
+        logger.warning("WEBHOOK_URL не задан: вебхук в Telegram не ставится (локальный режим)")
+        return
+    try:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
     finally:
+        # Сессия главного процесса не должна достаться воркерам
         await bot.session.close()
-        # ВАЖНО: Используем database.db_pool для проверки и закрытия
-        if database.db_pool: 
-            await database.db_pool.close()
+
+async def run_webhook_worker(worker_index, workers):
+    # Лимит Bot API общий на токен — делим его между webhook-процессами и monitor_worker.py
+    outbound.share(API_PROCESSES)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    await startup(worker_index)
+    receiver = UpdateReceiver(dp, bot)
+    runner = await serve(build_app(receiver), WEBAPP_HOST, WEBAPP_PORT, reuse_port=workers > 1)
+    try:
+        await stop.wait()
+        logger.info("Остановка webhook-процесса")
+    finally:
+        # Сначала перестаем принимать апдейты, потом дорабатываем принятые
+        # (Telegram их уже не пришлет), затем обычная остановка с отправкой уведомлений
+        await runner.cleanup()
+        await receiver.drain()
+        await shutdown()
+
+def _webhook_process_main(worker_index, workers):
+    # Обработчики сигналов главного процесса достались по fork — сбрасываем,
+    # пока run_webhook_worker не поставит свои
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        asyncio.run(run_webhook_worker(worker_index, workers))
+    except KeyboardInterrupt:
+        pass
+
+def main_webhook():
+    asyncio.run(set_webhook())
+    if WEB_WORKERS <= 1:
+        _webhook_process_main(0, 1)
+        return
+
+    processes = [
+        multiprocessing.Process(target=_webhook_process_main, args=(index, WEB_WORKERS), name=f"webhook-{index}")
+        for index in range(WEB_WORKERS)
+    ]
+
+    # SIGTERM/SIGINT главному процессу пересылаются воркерам: каждый штатно
+    # останавливается, а порт не остается занят осиротевшими процессами
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено webhook-процессов: {len(processes)}")
+    for process in processes:
+        process.join()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if BOT_MODE == "webhook":
+        main_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+from database import (
+    db_count_broadcast_audience, db_create_broadcast, db_claim_stale_broadcasts,
+    db_get_broadcast_recipients, db_broadcast_checkpoint, db_cancel_broadcast,
+    db_mark_blocked_users
+)
+from outbound import outbound_priority, LOW
+from statements import BROADCAST_AUDIENCES
+
+logger = logging.getLogger(__name__)
+
+# --- РАССЫЛКИ ---
+# Получатели читаются порциями по user_id по возрастанию (keyset) и уходят
+# пачками через низкую полосу outbound: скорость упирается в общий лимит Bot API,
+# ответы пользователям идут первыми. После каждой пачки в broadcasts пишется
+# чекпоинт (last_user_id и счетчики). Если процесс упал, рассылку без свежего
+# чекпоинта подхватывает любой живой процесс бота и продолжает с last_user_id.
+# Заблокировавшие бота попадают в blocked_users и в следующие рассылки не идут.
+
+BATCH_SIZE = 100            # сообщений между чекпоинтами (столько может уйти повторно после падения)
+CHUNK_SIZE = 2000           # получателей на один запрос к БД
+PROGRESS_INTERVAL = 15      # секунд между обновлениями прогресса у админа
+STALE_AFTER = 120           # секунд без чекпоинта — владелец рассылки считается мертвым
+RESUME_INTERVAL = 60        # как часто искать брошенные рассылки
+
+SENT, FAILED, BLOCKED = 'sent', 'failed', 'blocked'
+
+AUDIENCE_NAMES = {
+    'all': 'все пользователи',
+    'earned': 'с заработанным балансом',
+    'active': 'активные за {days} дн.',
+}
+
+
+def parse_audience(args):
+    """["active", "7"] -> ("active", 7). ValueError, если аудитория не распознана."""
+    if not args or args[0] not in BROADCAST_AUDIENCES:
+        raise ValueError("unknown audience")
+    audience = args[0]
+    if audience != 'active':
+        return audience, None
+    days = int(args[1]) if len(args) > 1 else 0
+    if days <= 0:
+        raise ValueError("days must be positive")
+    return audience, days
+
+
+def audience_title(audience, days):
+    return AUDIENCE_NAMES[audience].format(days=days)
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60} с"
+    return f"{seconds} с"
+
+
+class _Progress:
+    """Счетчики рассылки и скорость текущего прогона (для ETA)."""
+
+    def __init__(self, row):
+        self.total = row['total']
+        self.sent = row['sent']
+        self.failed = row['failed']
+        self.blocked = row['blocked']
+        self._started_at = time.monotonic()
+        self._done_at_start = self.done
+        self.reported_at = time.monotonic()
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.blocked
+
+    def rate(self):
+        elapsed = time.monotonic() - self._started_at
+        return (self.done - self._done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def render(self, broadcast_id, title, audience):
+        rate = self.rate()
+        # Аудитория могла вырасти с момента подсчета
+        remaining = max(self.total - self.done, 0)
+        eta = _format_duration(remaining / rate) if rate > 0 else "—"
+        return (
+            f"{title} <b>#{broadcast_id}</b>\n"
+            f"Аудитория: {audience}\n\n"
+            f"Обработано: {self.done}/{self.total}\n"
+            f"✅ Доставлено: {self.sent}\n"
+            f"⛔ Заблокировали бота: {self.blocked}\n"
+            f"⚠️ Ошибок: {self.failed}\n\n"
+            f"Скорость: {rate:.1f} сообщ./с\n"
+            f"Осталось: ~{eta}"
+        )
+
+
+class Broadcaster:
+    def __init__(self):
+        self._bot = None
+        self._owner = None
+        self._running = {}          # broadcast_id -> asyncio.Task
+        self._resume_task = None
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        # Владелец — конкретный процесс: start() вызывается уже после fork воркеров
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._resume_task = asyncio.create_task(self._resume_loop())
+
+    async def stop(self):
+        """Останавливает рассылки без смены статуса: их продолжит следующий запуск."""
+        tasks = list(self._running.values())
+        if self._resume_task is not None:
+            tasks.append(self._resume_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._running.clear()
+
+    async def create(self, admin_id, audience, days, text):
+        total = await db_count_broadcast_audience(audience, days)
+        row = await db_create_broadcast(admin_id, audience, days, text, total, self._owner)
+        self._launch(row)
+        return row
+
+    async def cancel(self, broadcast_id):
+        """Рассылка остановится на ближайшем чекпоинте (в любом процессе)."""
+        return await db_cancel_broadcast(broadcast_id)
+
+    def _launch(self, row):
+        broadcast_id = row['id']
+        task = asyncio.create_task(self._run(row))
+        self._running[broadcast_id] = task
+        task.add_done_callback(lambda _: self._running.pop(broadcast_id, None))
+
+    async def _resume_loop(self):
+        while True:
+            try:
+                for row in await db_claim_stale_broadcasts(self._owner, STALE_AFTER):
+                    if row['id'] in self._running:
+                        continue
+                    logger.info(f"Рассылка #{row['id']} продолжается с user_id > {row['last_user_id']}")
+                    self._launch(row)
+            except Exception as e:
+                logger.error(f"Ошибка поиска брошенных рассылок: {e}")
+            await asyncio.sleep(RESUME_INTERVAL)
+
+    async def _run(self, row):
+        # Контекст задачи рассылки: все ее запросы — фоновые
+        outbound_priority.set(LOW)
+        broadcast_id = row['id']
+        progress = _Progress(row)
+        audience = audience_title(row['audience'], row['audience_days'])
+        resumed = row['last_user_id'] > 0
+        title = "▶️ Рассылка продолжена" if resumed else "📣 Рассылка"
+        status_message = await self._report(row['admin_id'], None, progress.render(broadcast_id, title, audience))
+
+        last_user_id = row['last_user_id']
+        status = 'running'
+        try:
+            while status == 'running':
+                # Порция читается целиком, соединение пула возвращается до отправки
+                recipients = await db_get_broadcast_recipients(
+                    row['audience'], row['audience_days'], last_user_id, CHUNK_SIZE
+                )
+                # Неполная порция значит, что получатели закончились
+                finished = len(recipients) < CHUNK_SIZE
+                if not recipients:
+                    status = await self._send_batch(row, [], progress, last_user_id=last_user_id, done=True)
+                    break
+
+                for offset in range(0, len(recipients), BATCH_SIZE):
+                    batch = recipients[offset:offset + BATCH_SIZE]
+                    last_batch = finished and offset + BATCH_SIZE >= len(recipients)
+                    status = await self._send_batch(row, batch, progress, done=last_batch)
+                    last_user_id = batch[-1]
+                    if status != 'running':
+                        break
+
+                    if time.monotonic() - progress.reported_at >= PROGRESS_INTERVAL:
+                        progress.reported_at = time.monotonic()
+                        status_message = await self._report(
+                            row['admin_id'], status_message, progress.render(broadcast_id, title, audience)
+                        )
+        except Exception as e:
+            # Статус остается running: рассылку подхватит _resume_loop после STALE_AFTER
+            logger.error(f"Рассылка #{broadcast_id} прервана: {e}")
+            return
+
+        if status is None:
+            logger.info(f"Рассылку #{broadcast_id} подхватил другой процесс")
+            return
+        titles = {'done': "✅ Рассылка завершена", 'cancelled': "🛑 Рассылка остановлена"}
+        await self._report(row['admin_id'], status_message, progress.render(broadcast_id, titles.get(status, status), audience))
+        logger.info(f"Рассылка #{broadcast_id}: {status}, доставлено {progress.sent}, "
+                    f"заблокировали {progress.blocked}, ошибок {progress.failed}")
+
+    async def _send_batch(self, row, batch, progress, last_user_id=None, done=False):
+        """Отправляет пачку, пишет чекпоинт и возвращает статус рассылки (None — рассылка не наша)."""
+        results = await asyncio.gather(*(self._deliver(user_id, row['text']) for user_id in batch))
+        blocked_ids = [user_id for user_id, result in zip(batch, results) if result == BLOCKED]
+        sent = results.count(SENT)
+        failed = results.count(FAILED)
+
+        await db_mark_blocked_users(blocked_ids)
+        status = await db_broadcast_checkpoint(
+            row['id'], self._owner, batch[-1] if batch else last_user_id,
+            sent, failed, len(blocked_ids), done
+        )
+        progress.sent += sent
+        progress.failed += failed
+        progress.blocked += len(blocked_ids)
+        return status
+
+    async def _deliver(self, user_id, text):
+        # Лимиты Bot API и RetryAfter обрабатывает outbound
+        try:
+            await self._bot.send_message(user_id, text, parse_mode="HTML")
+            return SENT
+        except TelegramForbiddenError:
+            return BLOCKED
+        except Exception as e:
+            logger.debug(f"Рассылка: не доставлено {user_id}: {e}")
+            return FAILED
+
+    async def _report(self, admin_id, message, text):
+        """Отправляет или обновляет сообщение о прогрессе; ошибки не прерывают рассылку."""
+        try:
+            if message is None:
+                return await self._bot.send_message(admin_id, text, parse_mode="HTML")
+            await self._bot.edit_message_text(
+                text, chat_id=admin_id, message_id=message.message_id, parse_mode="HTML"
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки у {admin_id}: {e}")
+        return message
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import asyncpg
+from pagination import decode_cursor, AFTER, BEFORE, START
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'task_catalog'
+
+_EPOCH = datetime(1970, 1, 1)
+
+# --- КАТАЛОГ ОТКРЫТЫХ ЗАДАНИЙ В ПАМЯТИ ---
+# Списки "💰 Заработать" читаются гораздо чаще, чем меняются задания, поэтому
+# открытые задания держим в памяти процесса. Актуальность поддерживают триггеры
+# на tasks/completed (pg_notify в канал task_catalog, см. миграции).
+# Пока каталог не готов (старт, обрыв LISTEN-соединения) — database.py ходит в БД.
+
+
+def _sort_key(price, created_at, task_id):
+    """Ключ по возрастанию = порядок списка (цена, дата, id — все по убыванию)."""
+    return (-Decimal(price), -((created_at - _EPOCH) // timedelta(microseconds=1)), -task_id)
+
+
+class TaskCatalog:
+    def __init__(self, completed_cache_size=20000):
+        self.ready = False
+        self._tasks = {}        # id -> dict задания
+        self._by_type = {}      # task_type -> отсортированный список _sort_key
+        self._by_owner = {}     # owner_id -> set id открытых заданий владельца
+        # user_id -> отсортированный array('q') с id выполненных заданий (LRU)
+        self._completed = OrderedDict()
+        self._completed_cache_size = completed_cache_size
+        self._completed_loading = {}    # user_id -> id, пришедшие во время загрузки
+        self._pool = None
+        self._dsn = None
+        self._conn = None
+        self._buffer = None             # уведомления, пришедшие во время перезагрузки
+        self._reconnect_task = None
+        self._closing = False
+
+    # --- ЖИЗНЕННЫЙ ЦИКЛ ---
+    async def start(self, pool, dsn):
+        self._pool = pool
+        self._dsn = dsn
+        try:
+            await self._connect()
+        except Exception as e:
+            logger.error(f"Каталог заданий не запущен, работаем через БД: {e}")
+            self._schedule_reconnect()
+
+    async def stop(self):
+        self._closing = True
+        self.ready = False
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        if self._conn and not self._conn.is_closed():
+            await self._conn.close()
+
+    async def _connect(self):
+        # Сначала LISTEN, потом загрузка: так не теряются изменения между ними
+        self._buffer = []
+        self._conn = await asyncpg.connect(dsn=self._dsn)
+        self._conn.add_termination_listener(self._on_terminate)
+        await self._conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        await self.reload()
+
+    def _on_terminate(self, conn):
+        if self._closing:
+            return
+        logger.warning("LISTEN-соединение каталога потеряно, переключаемся на БД")
+        self.ready = False
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        delay = 1
+        while not self._closing:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+                logger.info("Каталог заданий переподключен")
+                return
+            except Exception as e:
+                logger.error(f"Ошибка переподключения каталога: {e}")
+                delay = min(delay * 2, 60)
+
+    async def reload(self):
+        """Полная перезагрузка — fallback для согласованности после переподключения."""
+        self.ready = False
+        if self._buffer is None:
+            self._buffer = []
+        async with self._pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT * FROM tasks
+                WHERE active = TRUE AND paused = FALSE AND count_done < count_needed
+            ''')
+
+        self._tasks = {}
+        self._by_type = {}
+        self._by_owner = {}
+        # Пока соединения не было, выполнения могли пройти мимо нас
+        self._completed.clear()
+        for row in rows:
+            self._put(dict(row))
+
+        # Изменения, пришедшие во время загрузки, перечитываем из БД целиком
+        buffered, self._buffer = self._buffer, None
+        changed = {item['id'] for item in buffered if 'id' in item}
+        if changed:
+            async with self._pool.acquire() as conn:
+                rows = await conn.fetch("SELECT * FROM tasks WHERE id = ANY($1::int[])", list(changed))
+            for task_id in changed:
+                self._drop(task_id)
+            for row in rows:
+                self._apply_task(dict(row))
+
+        self.ready = True
+        logger.info(f"Каталог заданий загружен: {len(self._tasks)} открытых")
+
+    # --- ПРИМЕНЕНИЕ ИЗМЕНЕНИЙ ---
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            event = json.loads(payload, parse_float=Decimal)
+        except ValueError:
+            logger.error(f"Некорректное уведомление каталога: {payload[:200]}")
+            return
+
+        if event.get('op') in ('completed', 'uncompleted'):
+            self._apply_completed(event)
+            return
+
+        task = event.get('task') or {}
+        if self._buffer is not None:
+            self._buffer.append({'id': task.get('id', event.get('id'))})
+            return
+
+        if event.get('op') == 'delete':
+            self._drop(event['id'])
+        else:
+            task['created_at'] = datetime.fromisoformat(task['created_at'])
+            task['price_per_sub'] = Decimal(task['price_per_sub'])
+            self._apply_task(task)
+
+    @staticmethod
+    def _is_open(task):
+        return (bool(task['active']) and not task.get('paused')
+                and task['count_done'] < task['count_needed'])
+
+    def _apply_task(self, task):
+        self._drop(task['id'])
+        if self._is_open(task):
+            self._put(task)
+
+    def _put(self, task):
+        self._tasks[task['id']] = task
+        key = _sort_key(task['price_per_sub'], task['created_at'], task['id'])
+        insort(self._by_type.setdefault(task['task_type'], []), key)
+        self._by_owner.setdefault(task['owner_id'], set()).add(task['id'])
+
+    def _drop(self, task_id):
+        task = self._tasks.pop(task_id, None)
+        if task is None:
+            return
+        keys = self._by_type.get(task['task_type'], [])
+        key = _sort_key(task['price_per_sub'], task['created_at'], task['id'])
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+        owned = self._by_owner.get(task['owner_id'])
+        if owned is not None:
+            owned.discard(task_id)
+            if not owned:
+                del self._by_owner[task['owner_id']]
+
+    def _apply_completed(self, event):
+        user_id, task_id = event['user_id'], event['task_id']
+        pending = self._completed_loading.get(user_id)
+        if pending is not None:
+            pending.append((event['op'], task_id))
+        ids = self._completed.get(user_id)
+        if ids is None:
+            return
+        index = bisect_left(ids, task_id)
+        present = index < len(ids) and ids[index] == task_id
+        if event['op'] == 'completed' and not present:
+            ids.insert(index, task_id)
+        elif event['op'] == 'uncompleted' and present:
+            del ids[index]
+
+    def note_completed(self, user_id, task_id):
+        """Локально отмечает выполнение, не дожидаясь NOTIFY (список перерисуется сразу)."""
+        self._apply_completed({'op': 'completed', 'user_id': user_id, 'task_id': task_id})
+
+    # --- ВЫПОЛНЕННЫЕ ЗАДАНИЯ ПОЛЬЗОВАТЕЛЯ ---
+    async def _completed_ids(self, user_id):
+        ids = self._completed.get(user_id)
+        if ids is not None:
+            self._completed.move_to_end(user_id)
+            return ids
+
+        self._completed_loading[user_id] = []
+        try:
+            async with self._pool.acquire() as conn:
+                rows = await conn.stmt('completed_ids').fetch(user_id)
+            ids = array('q', (row['task_id'] for row in rows))
+            for op, task_id in self._completed_loading[user_id]:
+                index = bisect_left(ids, task_id)
+                present = index < len(ids) and ids[index] == task_id
+                if op == 'completed' and not present:
+                    ids.insert(index, task_id)
+                elif op == 'uncompleted' and present:
+                    del ids[index]
+        finally:
+            self._completed_loading.pop(user_id, None)
+
+        self._completed[user_id] = ids
+        while len(self._completed) > self._completed_cache_size:
+            self._completed.popitem(last=False)
+        return ids
+
+    def _visible(self, task, user_id, done_ids):
+        if task['owner_id'] == user_id:
+            return False
+        index = bisect_left(done_ids, task['id'])
+        return not (index < len(done_ids) and done_ids[index] == task['id'])
+
+    def _hidden_counts(self, user_id, done_ids, task_type=None):
+        """
+        task_type -> сколько открытых заданий скрыто от пользователя (свои и выполненные).
+        Стоит O(своих + выполненных), а не O(открытых заданий).
+        """
+        hidden = {}
+        for task_id in self._by_owner.get(user_id, ()):
+            kind = self._tasks[task_id]['task_type']
+            if task_type is None or kind == task_type:
+                hidden[kind] = hidden.get(kind, 0) + 1
+        for task_id in done_ids:
+            task = self._tasks.get(task_id)
+            if task is None or task['owner_id'] == user_id:
+                continue
+            kind = task['task_type']
+            if task_type is None or kind == task_type:
+                hidden[kind] = hidden.get(kind, 0) + 1
+        return hidden
+
+    # --- ЧТЕНИЕ ---
+    async def available_counts(self, user_id):
+        """task_type -> количество заданий, доступных пользователю."""
+        done_ids = await self._completed_ids(user_id)
+        hidden = self._hidden_counts(user_id, done_ids)
+        return {task_type: len(keys) - hidden.get(task_type, 0) for task_type, keys in self._by_type.items()}
+
+    async def get_page(self, user_id, task_type, cursor=None, per_page=5):
+        """То же, что database.db_get_tasks_paginated, но без обращения к БД."""
+        done_ids = await self._completed_ids(user_id)
+        keys = self._by_type.get(task_type, [])
+        direction, cursor_key = decode_cursor(cursor)
+        if cursor_key is not None and len(cursor_key) != 3:
+            direction = None
+
+        rows = []
+        if direction == BEFORE:
+            index = bisect_left(keys, _sort_key(*cursor_key)) - 1
+            while index >= 0 and len(rows) < per_page:
+                task = self._tasks[-keys[index][2]]
+                if self._visible(task, user_id, done_ids):
+                    rows.append(task)
+                index -= 1
+            rows.reverse()
+            has_next = True
+        else:
+            if direction == AFTER:
+                index = bisect_right(keys, _sort_key(*cursor_key))
+            elif direction == START:
+                index = bisect_left(keys, _sort_key(*cursor_key))
+            else:
+                index = 0
+            while index < len(keys) and len(rows) <= per_page:
+                task = self._tasks[-keys[index][2]]
+                if self._visible(task, user_id, done_ids):
+                    rows.append(task)
+                index += 1
+            has_next = len(rows) > per_page
+            rows = rows[:per_page]
+
+        total_count = len(keys) - self._hidden_counts(user_id, done_ids, task_type).get(task_type, 0)
+        return rows, total_count, has_next
+
+
+task_catalog = TaskCatalog()
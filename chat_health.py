@@ -0,0 +1,116 @@
+import logging
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from cache import TTLCache
+from database import db_pause_chat_tasks, db_resume_chat_tasks
+from notifier import notifier
+
+logger = logging.getLogger(__name__)
+
+# --- ЗДОРОВЬЕ ЧАТОВ (CIRCUIT BREAKER) ---
+# Если бот потерял админку или чат удален, каждая проверка подписки в нем
+# заканчивается ошибкой. После FAILURE_THRESHOLD таких ошибок подряд задания
+# чата ставятся на паузу (tasks.paused): они пропадают из "💰 Заработать" и из
+# очереди мониторинга, владелец получает уведомление. Когда бота снова делают
+# админом (my_chat_member), пауза снимается.
+# Источник правды — tasks.paused (subscriptions_lease берет только непаузные
+# задания). _open лишь на короткое время избавляет остаток текущей пачки от
+# запросов к API: апдейт my_chat_member мог прийти в другой процесс, поэтому
+# по истечении OPEN_TTL чат снова проверяется, если его подписки вернулись в очередь.
+
+FAILURE_THRESHOLD = 3
+FAILURE_WINDOW = 600  # секунд: ошибки реже этого не накапливаются
+OPEN_TTL = 300        # секунд: сколько процесс считает чат недоступным без запросов к API
+
+# Ответы Bot API, которые означают "бот не может смотреть участников чата"
+DEAD_CHAT_ERRORS = (
+    'not enough rights',
+    'chat not found',
+    'member list is inaccessible',
+    'bot is not a member',
+    'bot was kicked',
+    'chat_admin_required',
+)
+
+
+def is_dead_chat_error(error):
+    if not isinstance(error, (TelegramBadRequest, TelegramForbiddenError)):
+        return False
+    message = str(error).lower()
+    return any(text in message for text in DEAD_CHAT_ERRORS)
+
+
+def _chat_args(chat):
+    """task_chat() -> (chat_id, "@username") для запросов по чату."""
+    return (chat, None) if isinstance(chat, int) else (None, chat)
+
+
+class ChatHealth:
+    def __init__(self):
+        self._failures = TTLCache(ttl=FAILURE_WINDOW)
+        self._open = TTLCache(ttl=OPEN_TTL)     # чаты, задания которых этот процесс недавно поставил на паузу
+
+    def is_open(self, chat):
+        return self._open.get(chat, False)
+
+    def record_success(self, chat):
+        self._failures.pop(chat)
+
+    async def record_failure(self, chat, error):
+        """Учитывает ошибку проверки; True — чат признан недоступным и поставлен на паузу."""
+        if self.is_open(chat):
+            return True
+        if not is_dead_chat_error(error):
+            return False
+        failures = self._failures.get(chat, 0) + 1
+        self._failures.set(chat, failures)
+        if failures < FAILURE_THRESHOLD:
+            return False
+        await self.trip(chat, str(error))
+        return True
+
+    async def trip(self, chat, reason, alias=None):
+        """
+        Ставит задания чата на паузу и предупреждает владельцев.
+        alias — "@username" чата, если chat — его числовой id: по нему находятся
+        старые задания, у которых еще нет chat_id.
+        """
+        chat_id, username = _chat_args(chat)
+        if alias is not None:
+            username = alias
+        for key in (chat, alias):
+            if key is not None:
+                self._open.set(key, True)
+                self._failures.pop(key)
+        tasks = await db_pause_chat_tasks(chat_id, username)
+        if not tasks:
+            return
+        logger.warning(f"Чат {chat} недоступен ({reason}), на паузе заданий: {len(tasks)}")
+
+        # Владельцев завершенных заданий не беспокоим
+        for task in tasks:
+            if not task['is_open']:
+                continue
+            notifier.send(
+                task['owner_id'],
+                f"⏸ <b>Задание #{task['id']} приостановлено</b>\n\n"
+                f"Бот больше не может проверять подписчиков в <b>{task['channel_title']}</b> "
+                f"(нет прав администратора или чат удален).\n\n"
+                f"Верните боту права администратора — задание возобновится автоматически.",
+                parse_mode="HTML"
+            )
+
+    async def reset(self, chat_id, chat=None):
+        """Бот снова админ: закрываем breaker и снимаем паузу с заданий чата."""
+        for key in (chat_id, chat):
+            if key is not None:
+                self._open.pop(key)
+                self._failures.pop(key)
+        resumed = await db_resume_chat_tasks(chat_id, chat)
+        if resumed:
+            logger.info(f"Чат {chat_id} снова доступен, возобновлено заданий: {resumed}")
+        return resumed
+
+
+chat_health = ChatHealth()
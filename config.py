@@ -18,6 +18,37 @@ MIN_REACTION_PRICE = 150.0  # Цена за реакцию
 MIN_BOT_PRICE = 800.0       # Цена за запуск бота
 UNSUB_CHECK_DAYS = 5        # Срок обязательной подписки (дней)
 
+# Мониторинг отписок внутри процесса бота. Выключите (RUN_MONITOR=0), если
+# мониторинг запущен отдельно: python monitor_worker.py --workers N (и MONITOR_PROCESSES=N)
+RUN_MONITOR = os.getenv("RUN_MONITOR", "1") != "0"
+
+# Прием апдейтов: BOT_MODE=polling (по умолчанию) или webhook. В режиме webhook
+# апдейты принимает aiohttp-сервер на WEBAPP_HOST:WEBAPP_PORT, WEB_WORKERS процессов
+# слушают один порт (SO_REUSEPORT). Без WEBHOOK_URL вебхук в Telegram не ставится —
+# так сервер можно гонять локально, отправляя POST с сохраненными апдейтами.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")          # публичный https-адрес без пути
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")    # заголовок X-Telegram-Bot-Api-Secret-Token
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# Общее хранилище состояний FSM (redis://...; нужен пакет redis). Обязательно при
+# WEB_WORKERS > 1: апдейты одного пользователя попадают в разные процессы
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Лимит Bot API общий на токен. MONITOR_PROCESSES — число процессов monitor_worker.py
+# (0 — мониторинг внутри бота); вместе с процессами бота они делят глобальный
+# лимит исходящих запросов поровну (outbound.share)
+MONITOR_PROCESSES = int(os.getenv("MONITOR_PROCESSES", "0"))
+BOT_PROCESSES = WEB_WORKERS if BOT_MODE == "webhook" else 1
+API_PROCESSES = BOT_PROCESSES + MONITOR_PROCESSES
+
 if not TOKEN or not DATABASE_URL:
     raise ValueError("Не все переменные окружения установлены!")
 
+if BOT_MODE == "webhook":
+    if not WEBHOOK_SECRET:
+        raise ValueError("Для BOT_MODE=webhook нужен WEBHOOK_SECRET!")
+    if WEB_WORKERS > 1 and not REDIS_URL:
+        raise ValueError("Для WEB_WORKERS > 1 нужен REDIS_URL (общее хранилище FSM)!")
@@ -1,125 +1,98 @@
 import asyncpg
 import logging
 from config import DATABASE_URL, CURRENCY_NAME, UNSUB_CHECK_DAYS
+from migrations import migrate
+from cache import TTLCache
+from pagination import decode_cursor, AFTER, BEFORE, START
+from catalog import task_catalog
+from statements import BotConnection, init_connection
 
 logger = logging.getLogger(__name__)
 
 db_pool = None
 
+# Порядок совпадает с результатом db_get_available_counts
+TASK_TYPES = ('channel', 'group', 'view', 'reaction', 'bot')
+
+# Счетчики доступных заданий для меню "💰 Заработать" (user_id -> 5 чисел).
+# Живут недолго: чужие выполнения и новые задания видны максимум через TTL.
+_counts_cache = TTLCache(ttl=15)
+
+# Балансы пользователей (user_id -> (balance, earned_balance)) для "👤 Кабинет"
+# и проверки стоимости рекламы. Все изменения баланса в этом процессе пишут сюда
+# новое значение; TTL страхует от изменений из других процессов.
+_user_cache = TTLCache(ttl=30, maxsize=50000)
+
+# Статистика для /start: несколько секунд устаревания никто не заметит
+_stats_cache = TTLCache(ttl=5, maxsize=1)
+
+# Чаты, для которых tasks.member_event_at уже обновлен недавно: при каждом
+# входе/выходе участника писать в tasks незачем
+_member_event_marks = TTLCache(ttl=600)
+
+def _cache_balance(user_id, row):
+    """Write-through в кэш балансов по строке с balance/earned_balance."""
+    if row is None or row['balance'] is None:
+        _user_cache.pop(user_id)
+        return
+    _user_cache.set(user_id, (float(row['balance']), float(row['earned_balance'])))
+
 # --- БАЗА ДАННЫХ ---
-async def init_db():
+async def init_db(with_catalog=True):
     global db_pool
     
-    db_pool = await asyncpg.create_pool(dsn=DATABASE_URL, min_size=2, max_size=10)
+    # Схема ведется миграциями: при актуальной версии здесь только чтение версии схемы.
+    # Миграции идут до создания пула — init-хук пула готовит запросы к актуальной схеме.
+    conn = await asyncpg.connect(dsn=DATABASE_URL)
+    try:
+        await migrate(conn)
+    finally:
+        await conn.close()
+    
+    db_pool = await asyncpg.create_pool(
+        dsn=DATABASE_URL, min_size=2, max_size=10,
+        connection_class=BotConnection, init=init_connection
+    )
     logger.info("Пул БД создан")
     
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                balance NUMERIC(10, 4) DEFAULT 0.0,
-                earned_balance NUMERIC(10, 4) DEFAULT 0.0,
-                created_at TIMESTAMP DEFAULT NOW()
-            );
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS invoices (
-                invoice_id TEXT PRIMARY KEY, 
-                user_id BIGINT,
-                amount NUMERIC(10, 4),
-                payment_type TEXT DEFAULT 'stars',
-                status TEXT DEFAULT 'active',
-                created_at TIMESTAMP DEFAULT NOW()
-            );
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                id SERIAL PRIMARY KEY,
-                owner_id BIGINT,
-                channel_link TEXT,
-                channel_title TEXT, 
-                task_type TEXT DEFAULT 'channel',
-                price_per_sub NUMERIC(10, 4), 
-                count_needed INTEGER,
-                count_done INTEGER DEFAULT 0,
-                active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT NOW()
-            );
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS completed (
-                user_id BIGINT,
-                task_id INTEGER,
-                completed_at TIMESTAMP DEFAULT NOW(),
-                PRIMARY KEY (user_id, task_id)
-            );
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                user_id BIGINT,
-                task_id INTEGER,
-                subscribed_at TIMESTAMP DEFAULT NOW(),
-                checked_at TIMESTAMP,
-                rewarded BOOLEAN DEFAULT TRUE,
-                penalized BOOLEAN DEFAULT FALSE, 
-                PRIMARY KEY (user_id, task_id)
-            );
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                amount NUMERIC(10, 4),
-                type TEXT,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT NOW()
-            );
-        ''')
-        
-        await conn.execute('''
-            CREATE TABLE IF NOT EXISTS pending_reviews (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                task_id INTEGER,
-                status TEXT DEFAULT 'pending', 
-                created_at TIMESTAMP DEFAULT NOW()
-            );
-        ''')
-        
-        logger.info("✅ Таблицы БД созданы/проверены")
+    # Каталог открытых заданий в памяти (до готовности списки читаются из БД).
+    # Процессам мониторинга (monitor_worker.py) списки заданий не нужны
+    if with_catalog:
+        await task_catalog.start(db_pool, DATABASE_URL)
 
 # --- DB HELPERS ---
 async def db_get_user(user_id):
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return cached
     try:
         async with db_pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO users (user_id) VALUES ($1) ON CONFLICT (user_id) DO NOTHING", 
-                user_id
-            )
-            row = await conn.fetchrow("SELECT balance, earned_balance FROM users WHERE user_id = $1", user_id)
-            if row:
-                return float(row['balance']), float(row['earned_balance'])
-            return 0.0, 0.0
+            row = await conn.stmt('user_get').fetchrow(user_id)
+            if row is None:
+                # Строку вставил параллельный запрос уже после снимка — новый снимок ее увидит
+                row = await conn.stmt('user_get').fetchrow(user_id)
+        _cache_balance(user_id, row)
+        return float(row['balance']), float(row['earned_balance'])
     except Exception as e:
         logger.error(f"Ошибка получения пользователя {user_id}: {e}")
         return 0.0, 0.0
 
+async def db_touch_user(user_id):
+    """Обновляет users.last_seen_at (аудитория рассылок "active N")."""
+    try:
+        async with db_pool.acquire() as conn:
+            await conn.stmt('user_touch').fetchval(user_id)
+    except Exception as e:
+        logger.error(f"Ошибка обновления активности {user_id}: {e}")
+
 async def db_update_balance(user_id, amount, tx_type=None, description=None, is_earned=False, force=False):
     try:
         async with db_pool.acquire() as conn:
             async with conn.transaction():
-                current = await conn.fetchrow(
-                    "SELECT balance, earned_balance FROM users WHERE user_id = $1 FOR UPDATE", 
-                    user_id
-                )
+                current = await conn.stmt('user_balance_for_update').fetchrow(user_id)
                 
                 if current is None:
-                    await conn.execute("INSERT INTO users (user_id) VALUES ($1)", user_id)
+                    await conn.stmt('user_insert').fetchval(user_id)
                     current = {'balance': 0.0, 'earned_balance': 0.0}
                 
                 if amount < 0 and not force:
@@ -131,227 +104,307 @@ async def db_update_balance(user_id, amount, tx_type=None, description=None, is_
                             raise ValueError("Недостаточно средств")
                 
                 if is_earned:
-                    await conn.execute(
-                        "UPDATE users SET earned_balance = earned_balance + $1 WHERE user_id = $2", 
-                        float(amount), user_id
-                    )
+                    row = await conn.stmt('user_add_earned').fetchrow(float(amount), user_id)
                 else:
-                    await conn.execute(
-                        "UPDATE users SET balance = balance + $1 WHERE user_id = $2", 
-                        float(amount), user_id
-                    )
+                    row = await conn.stmt('user_add_balance').fetchrow(float(amount), user_id)
                 
                 if tx_type:
-                    await conn.execute(
-                        "INSERT INTO transactions (user_id, amount, type, description) VALUES ($1, $2, $3, $4)",
-                        user_id, float(amount), tx_type, description
-                    )
-                return True
+                    await conn.stmt('transaction_insert').fetchval(user_id, float(amount), tx_type, description)
+            
+            _cache_balance(user_id, row)
+            return True
                 
     except Exception as e:
         logger.error(f"Ошибка обновления баланса {user_id}: {e}")
         raise
 
 async def db_get_global_stats():
+    cached = _stats_cache.get('global')
+    if cached is not None:
+        return cached
     try:
+        # Счетчики ведут триггеры (миграции 7 и 17): чтение не зависит от числа пользователей
         async with db_pool.acquire() as conn:
-            users_count = await conn.fetchval("SELECT COUNT(*) FROM users")
-            tasks_today = await conn.fetchval("SELECT COUNT(*) FROM completed WHERE completed_at >= CURRENT_DATE")
-            return int(users_count), int(tasks_today)
+            row = await conn.stmt('global_stats').fetchrow()
+        stats = (int(row['users_count']), int(row['tasks_today']))
+        _stats_cache.set('global', stats)
+        return stats
     except Exception as e:
         logger.error(f"Ошибка получения статистики: {e}")
         return 0, 0
 
-async def db_add_task(owner_id, link, title, task_type, price, count):
+async def db_purchase_task(owner_id, link, title, task_type, price, count, chat_id=None):
+    """
+    Оплата и создание задания одной транзакцией (функция purchase_task, миграции 8 и 11).
+    Возвращает (task_id, balance, earned_balance); task_id = None — не хватает средств.
+    """
     try:
         async with db_pool.acquire() as conn:
-            task_id = await conn.fetchval(
-                "INSERT INTO tasks (owner_id, channel_link, channel_title, task_type, price_per_sub, count_needed) VALUES ($1, $2, $3, $4, $5, $6) RETURNING id",
-                owner_id, link, title, task_type, float(price), int(count)
+            row = await conn.stmt('purchase_task').fetchrow(
+                owner_id, link, title, task_type, float(price), int(count), chat_id
             )
-            return task_id
+        _cache_balance(owner_id, {'balance': row['new_balance'], 'earned_balance': row['new_earned']})
+        if row['new_task_id'] is not None:
+            _counts_cache.clear()
+        return row['new_task_id'], float(row['new_balance']), float(row['new_earned'])
     except Exception as e:
-        logger.error(f"Ошибка создания задания: {e}")
+        logger.error(f"Ошибка покупки задания: {e}")
         raise
 
+async def db_get_task(task_id):
+    try:
+        async with db_pool.acquire() as conn:
+            return await conn.stmt('task_by_id').fetchrow(int(task_id))
+    except Exception as e:
+        logger.error(f"Ошибка получения задания {task_id}: {e}")
+        return None
+
 async def db_refund_penalty(user_id, task_id, refund_amount):
     try:
         async with db_pool.acquire() as conn:
             async with conn.transaction():
-                is_penalized = await conn.fetchval(
-                    "SELECT penalized FROM subscriptions WHERE user_id=$1 AND task_id=$2",
-                    user_id, task_id
-                )
+                is_penalized = await conn.stmt('subscription_penalized').fetchval(user_id, task_id)
                 
                 if not is_penalized:
                     return False, "Штраф уже снят или не был наложен."
 
-                await conn.execute(
-                    "UPDATE users SET earned_balance = earned_balance + $1 WHERE user_id = $2", 
-                    float(refund_amount), user_id
+                row = await conn.stmt('user_add_earned').fetchrow(float(refund_amount), user_id)
+                await conn.stmt('subscription_unpenalize').fetchval(user_id, task_id)
+                await conn.stmt('transaction_insert').fetchval(
+                    user_id, float(refund_amount), 'refund_penalty', f'Возврат штрафа за задачу #{task_id}'
                 )
-                await conn.execute(
-                    "UPDATE subscriptions SET penalized = FALSE WHERE user_id = $1 AND task_id = $2",
-                    user_id, task_id
-                )
-                await conn.execute(
-                    "INSERT INTO transactions (user_id, amount, type, description) VALUES ($1, $2, 'refund_penalty', $3)",
-                    user_id, float(refund_amount), f'Возврат штрафа за задачу #{task_id}'
-                )
-                return True, "Штраф успешно снят!"
+            
+            _cache_balance(user_id, row)
+            return True, "Штраф успешно снят!"
     except Exception as e:
         logger.error(f"Ошибка возврата штрафа: {e}")
         return False, "Ошибка базы данных"
     
-async def db_get_tasks_paginated(user_id, task_type, page=1, per_page=5):
-    offset = (page - 1) * per_page
+async def db_get_tasks_paginated(user_id, task_type, cursor=None, per_page=5):
+    """
+    Keyset-пагинация по (price_per_sub, created_at, id).
+    Возвращает (задания, всего, есть_следующая_страница).
+    Общее число берется из кэша счетчиков меню, а не отдельным COUNT(*).
+    """
+    if task_catalog.ready:
+        try:
+            return await task_catalog.get_page(user_id, task_type, cursor, per_page)
+        except Exception as e:
+            logger.error(f"Ошибка каталога заданий, читаем из БД: {e}")
+    
+    direction, key = decode_cursor(cursor)
+    if key is not None and len(key) != 3:
+        direction = None
     try:
         async with db_pool.acquire() as conn:
-            total_count = await conn.fetchval('''
-                SELECT COUNT(*) FROM tasks 
-                WHERE active = TRUE 
-                AND task_type = $2
-                AND count_done < count_needed 
-                AND owner_id != $1
-                AND id NOT IN (SELECT task_id FROM completed WHERE user_id = $1)
-            ''', user_id, task_type)
-
-            tasks = await conn.fetch('''
-                SELECT id, channel_link, channel_title, price_per_sub, task_type
-                FROM tasks 
-                WHERE active = TRUE 
-                AND task_type = $2
-                AND count_done < count_needed 
-                AND owner_id != $1
-                AND id NOT IN (SELECT task_id FROM completed WHERE user_id = $1)
-                ORDER BY price_per_sub DESC, created_at DESC
-                LIMIT $3 OFFSET $4
-            ''', user_id, task_type, per_page, offset)
+            if direction == BEFORE:
+                rows = await conn.stmt('tasks_page_before').fetch(user_id, task_type, per_page, *key)
+                rows.reverse()
+                has_next = True
+            elif direction == AFTER:
+                rows = await conn.stmt('tasks_page_after').fetch(user_id, task_type, per_page + 1, *key)
+            elif direction == START:
+                rows = await conn.stmt('tasks_page_start').fetch(user_id, task_type, per_page + 1, *key)
+            else:
+                rows = await conn.stmt('tasks_page_first').fetch(user_id, task_type, per_page + 1)
             
-            return tasks, total_count
+            if direction != BEFORE:
+                has_next = len(rows) > per_page
+                rows = rows[:per_page]
+        
+        counts = await db_get_available_counts(user_id)
+        total_count = counts[TASK_TYPES.index(task_type)] if task_type in TASK_TYPES else len(rows)
+        return rows, max(total_count, len(rows)), has_next
     except Exception as e:
         logger.error(f"Ошибка пагинации: {e}")
-        return [], 0
+        return [], 0, False
 
 async def db_get_available_counts(user_id):
+    if task_catalog.ready:
+        try:
+            counts = await task_catalog.available_counts(user_id)
+            return tuple(counts.get(task_type, 0) for task_type in TASK_TYPES)
+        except Exception as e:
+            logger.error(f"Ошибка каталога заданий, читаем из БД: {e}")
+    
+    cached = _counts_cache.get(user_id)
+    if cached is not None:
+        return cached
     try:
         async with db_pool.acquire() as conn:
-            base_condition = '''
-                active = TRUE 
-                AND count_done < count_needed 
-                AND owner_id != $1
-                AND id NOT IN (SELECT task_id FROM completed WHERE user_id = $1)
-            '''
+            # Один проход по открытым заданиям вместо пяти отдельных COUNT(*)
+            row = await conn.stmt('available_counts').fetchrow(user_id)
             
-            channels = await conn.fetchval(f"SELECT COUNT(*) FROM tasks WHERE task_type = 'channel' AND {base_condition}", user_id)
-            groups = await conn.fetchval(f"SELECT COUNT(*) FROM tasks WHERE task_type = 'group' AND {base_condition}", user_id)
-            views = await conn.fetchval(f"SELECT COUNT(*) FROM tasks WHERE task_type = 'view' AND {base_condition}", user_id)
-            reactions = await conn.fetchval(f"SELECT COUNT(*) FROM tasks WHERE task_type = 'reaction' AND {base_condition}", user_id)
-            bots = await conn.fetchval(f"SELECT COUNT(*) FROM tasks WHERE task_type = 'bot' AND {base_condition}", user_id)
-            
-            return int(channels), int(groups), int(views), int(reactions), int(bots)
+            counts = (
+                int(row['channels']), int(row['groups']), int(row['views']),
+                int(row['reactions']), int(row['bots'])
+            )
+            _counts_cache.set(user_id, counts)
+            return counts
     except Exception as e:
         logger.error(f"Ошибка подсчета заданий: {e}")
         return 0, 0, 0, 0, 0
 
-async def db_get_my_tasks_paginated(user_id, page=1, per_page=5):
-    offset = (page - 1) * per_page
+async def db_get_my_tasks_paginated(user_id, cursor=None, per_page=5):
+    """
+    Keyset-пагинация по (created_at, id); общее число приходит тем же запросом.
+    Возвращает (задания, всего, есть_следующая_страница).
+    """
+    direction, key = decode_cursor(cursor)
+    if key is not None and len(key) != 2:
+        direction = None
     try:
         async with db_pool.acquire() as conn:
-            total_count = await conn.fetchval('SELECT COUNT(*) FROM tasks WHERE owner_id = $1', user_id)
+            if direction == BEFORE:
+                rows = await conn.stmt('my_tasks_page_before').fetch(user_id, per_page, *key)
+                rows.reverse()
+                has_next = True
+            elif direction == AFTER:
+                rows = await conn.stmt('my_tasks_page_after').fetch(user_id, per_page + 1, *key)
+            elif direction == START:
+                rows = await conn.stmt('my_tasks_page_start').fetch(user_id, per_page + 1, *key)
+            else:
+                rows = await conn.stmt('my_tasks_page_first').fetch(user_id, per_page + 1)
             
-            tasks = await conn.fetch('''
-                SELECT id, channel_link, channel_title, task_type, price_per_sub, count_needed, count_done, active 
-                FROM tasks WHERE owner_id = $1 
-                ORDER BY created_at DESC 
-                LIMIT $2 OFFSET $3
-            ''', user_id, per_page, offset)
+            if direction != BEFORE:
+                has_next = len(rows) > per_page
+                rows = rows[:per_page]
             
-            return tasks, total_count
+            total_count = rows[0]['total_count'] if rows else 0
+            return rows, total_count, has_next
     except Exception:
-        return [], 0
+        return [], 0, False
 
 # --- МГНОВЕННОЕ ВЫПОЛНЕНИЕ ---
 async def db_complete_task_immediate(user_id, task_id):
     try:
         async with db_pool.acquire() as conn:
-            async with conn.transaction():
-                exists = await conn.fetchval("SELECT 1 FROM completed WHERE user_id=$1 AND task_id=$2", user_id, task_id)
-                if exists: 
-                    return False, "Задание уже выполнено"
-                
-                task = await conn.fetchrow(
-                    "SELECT count_done, count_needed, active, price_per_sub, task_type FROM tasks WHERE id = $1 FOR UPDATE",
-                    task_id
-                )
-                if not task or not task['active'] or task['count_done'] >= task['count_needed']:
-                    return False, "Задание неактивно или лимит исчерпан"
-                
-                actual_price = float(task['price_per_sub'])
-                task_type = task['task_type']
-                
-                # 1. Добавляем в completed
-                await conn.execute("INSERT INTO completed (user_id, task_id) VALUES ($1, $2)", user_id, task_id)
-                
-                # 2. МОНИТОРИНГ
-                if task_type not in ['view', 'reaction', 'bot']:
-                    await conn.execute(
-                        """INSERT INTO subscriptions (user_id, task_id, subscribed_at, rewarded) 
-                           VALUES ($1, $2, NOW(), TRUE) 
-                           ON CONFLICT (user_id, task_id) DO UPDATE SET subscribed_at = NOW(), rewarded = TRUE""",
-                        user_id, task_id
-                    )
-                
-                # 3. Обновляем счетчик задания
-                await conn.execute("UPDATE tasks SET count_done = count_done + 1 WHERE id = $1", task_id)
-                
-                # 4. Начисляем баланс
-                await conn.execute(
-                    "UPDATE users SET earned_balance = earned_balance + $1 WHERE user_id = $2", 
-                    actual_price, user_id
-                )
-                
-                # 5. Пишем транзакцию
-                await conn.execute(
-                    "INSERT INTO transactions (user_id, amount, type, description) VALUES ($1, $2, $3, $4)",
-                    user_id, actual_price, 'task_earn', f'Выполнение задания #{task_id} ({task_type})'
-                )
-                
-                return True, f"✅ Получено {int(actual_price)} {CURRENCY_NAME}"
+            # Вся логика выполнения — в серверной функции complete_task (миграция 5):
+            # одна транзакция и один round trip, блокировка задания держится минимально
+            result = await conn.stmt('complete_task').fetchrow(user_id, task_id)
+        
+        if not result['ok']:
+            if result['reason'] == 'already_done':
+                return False, "Задание уже выполнено"
+            return False, "Задание неактивно или лимит исчерпан"
+        
+        actual_price = float(result['price'])
+        if result['new_balance'] is None:
+            _user_cache.pop(user_id)
+        else:
+            _user_cache.set(user_id, (float(result['new_balance']), float(result['new_earned'])))
+        
+        # Сбрасываем кэш счетчиков уже после коммита: у исполнителя задание
+        # исчезло из списка, а при исчерпании лимита — у всех
+        if result['exhausted']:
+            _counts_cache.clear()
+        else:
+            _counts_cache.pop(user_id)
+        task_catalog.note_completed(user_id, task_id)
+        
+        return True, f"✅ Получено {int(actual_price)} {CURRENCY_NAME}"
                 
     except Exception as e:
         logger.error(f"Ошибка завершения задания: {e}")
         return False, "Ошибка обработки"
 
-async def db_apply_penalty(user_id, task_id, penalty_amount, channel_title):
+async def db_apply_penalties(items):
+    """
+    Штрафы за отписку одним запросом (флаг, списание и журнал атомарно).
+    items: [(user_id, task_id, penalty_amount, channel_title)].
+    Возвращает множество (user_id, task_id), по которым штраф действительно наложен:
+    если флаг уже стоял (выход поймали и апдейт chat_member, и мониторинг), второй раз не списываем.
+    """
+    if not items:
+        return set()
+    # Одна подписка — один штраф, даже если попала в пачку дважды
+    unique = {(user_id, task_id): (amount, title) for user_id, task_id, amount, title in items}
+    user_ids = [key[0] for key in unique]
+    task_ids = [key[1] for key in unique]
+    amounts = [float(value[0]) for value in unique.values()]
+    titles = [value[1] for value in unique.values()]
     try:
-        # 1. Списываем баланс
-        await db_update_balance(
-            user_id, 
-            -float(penalty_amount), 
-            tx_type='penalty', 
-            description=f'Штраф за отписку: {channel_title}', 
-            is_earned=True, 
-            force=True
+        async with db_pool.acquire() as conn:
+            rows = await conn.stmt('subscriptions_penalize_batch').fetch(user_ids, task_ids, amounts, titles)
+    except Exception as e:
+        logger.error(f"Ошибка применения штрафов ({len(unique)}): {e}")
+        return set()
+
+    for row in rows:
+        _cache_balance(row['user_id'], row)
+    return {(row['user_id'], row['task_id']) for row in rows}
+
+async def db_lease_due_subscriptions(owner, limit=500, lease_seconds=300):
+    """
+    Берет в аренду подписки, у которых наступил срок проверки (next_check_at <= сейчас).
+    Несколько воркеров получают непересекающиеся пачки; аренда истекает через lease_seconds.
+    """
+    async with db_pool.acquire() as conn:
+        return await conn.stmt('subscriptions_lease').fetch(limit, owner, lease_seconds)
+
+async def db_reschedule_subscriptions(owner, items):
+    """items: [(user_id, task_id, next_check_at | None)]; None снимает подписку с мониторинга."""
+    if not items:
+        return
+    user_ids, task_ids, next_checks = zip(*items)
+    async with db_pool.acquire() as conn:
+        await conn.stmt('subscriptions_reschedule').fetchval(
+            list(user_ids), list(task_ids), list(next_checks), owner
         )
-        # 2. ОЧЕНЬ ВАЖНО: Ставим флаг, что штраф уже наложен
+
+async def db_get_member_subscriptions(user_id, chat_id, chat=None):
+    """
+    Подписки юзера на чат, за отписку от которых положен штраф.
+    chat ("@username") нужен для старых заданий, у которых еще нет chat_id.
+    """
+    async with db_pool.acquire() as conn:
+        return await conn.stmt('subscriptions_for_chat_member').fetch(user_id, chat_id, chat)
+
+async def db_note_member_event(chat_id, chat=None):
+    """Отмечает, что из чата приходят апдейты chat_member (не чаще раза в 10 минут)."""
+    if _member_event_marks.get(chat_id):
+        return
+    _member_event_marks.set(chat_id, True)
+    try:
         async with db_pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE subscriptions SET penalized = TRUE WHERE user_id = $1 AND task_id = $2",
-                user_id, task_id
-            )
-        return True
+            await conn.stmt('tasks_mark_member_event').fetchval(chat_id, chat)
     except Exception as e:
-        logger.error(f"Ошибка применения штрафа: {e}")
-        return False
+        _member_event_marks.pop(chat_id)
+        logger.error(f"Ошибка отметки апдейтов чата {chat_id}: {e}")
+
+async def db_pause_chat_tasks(chat_id, chat=None):
+    """
+    Ставит на паузу задания чата (и завершенные: их подписки еще в мониторинге).
+    Возвращает строки (id, owner_id, channel_title, is_open).
+    """
+    async with db_pool.acquire() as conn:
+        rows = await conn.stmt('tasks_pause_chat').fetch(chat_id, chat)
+    if rows:
+        _counts_cache.clear()
+    return rows
+
+async def db_resume_chat_tasks(chat_id, chat=None):
+    """Снимает паузу с заданий чата; возвращает количество возобновленных."""
+    async with db_pool.acquire() as conn:
+        rows = await conn.stmt('tasks_resume_chat').fetch(chat_id, chat)
+    if rows:
+        _counts_cache.clear()
+    return len(rows)
+
+async def db_get_chats_without_id():
+    """Юзернеймы ("@name") чатов старых заданий, для которых еще не сохранен chat_id."""
+    async with db_pool.acquire() as conn:
+        rows = await conn.stmt('tasks_missing_chat_id').fetch()
+    return [row['chat'] for row in rows]
+
+async def db_set_chat_id(chat, chat_id):
+    async with db_pool.acquire() as conn:
+        await conn.stmt('tasks_set_chat_id').fetchval(chat_id, chat)
 
 async def db_add_invoice(invoice_id, user_id, amount):
     try:
         async with db_pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO invoices (invoice_id, user_id, amount, payment_type) VALUES ($1, $2, $3, 'stars')", 
-                str(invoice_id), user_id, float(amount)
-            )
+            await conn.stmt('invoice_insert').fetchval(str(invoice_id), user_id, float(amount))
     except Exception as e:
         logger.error(f"Ошибка инвойса: {e}")
 
@@ -359,10 +412,7 @@ async def db_add_invoice(invoice_id, user_id, amount):
 async def db_create_review(user_id, task_id):
     try:
         async with db_pool.acquire() as conn:
-            review_id = await conn.fetchval(
-                "INSERT INTO pending_reviews (user_id, task_id) VALUES ($1, $2) RETURNING id",
-                user_id, task_id
-            )
+            review_id = await conn.stmt('review_insert').fetchval(user_id, task_id)
             return review_id
     except Exception as e:
         logger.error(f"Error creating review: {e}")
@@ -371,14 +421,54 @@ async def db_create_review(user_id, task_id):
 async def db_get_review(review_id):
     try:
         async with db_pool.acquire() as conn:
-            return await conn.fetchrow("SELECT user_id, task_id FROM pending_reviews WHERE id=$1", int(review_id))
+            return await conn.stmt('review_get').fetchrow(int(review_id))
     except Exception:
         return None
 
 async def db_delete_review(review_id):
     try:
         async with db_pool.acquire() as conn:
-            await conn.execute("DELETE FROM pending_reviews WHERE id=$1", int(review_id))
+            await conn.stmt('review_delete').fetchval(int(review_id))
     except Exception:
         pass
 
+
+# --- DB HELPERS FOR BROADCASTS ---
+def _audience_args(days):
+    return () if days is None else (days,)
+
+async def db_count_broadcast_audience(audience, days=None):
+    async with db_pool.acquire() as conn:
+        return await conn.stmt(f'broadcast_count_{audience}').fetchval(*_audience_args(days))
+
+async def db_create_broadcast(admin_id, audience, days, text, total, owner):
+    async with db_pool.acquire() as conn:
+        return await conn.stmt('broadcast_create').fetchrow(admin_id, audience, days, text, total, owner)
+
+async def db_claim_stale_broadcasts(owner, stale_seconds):
+    """Забирает рассылки, владелец которых перестал писать чекпоинты (упал или остановлен)."""
+    async with db_pool.acquire() as conn:
+        return await conn.stmt('broadcast_claim_stale').fetch(owner, stale_seconds)
+
+async def db_get_broadcast_recipients(audience, days, after_user_id, limit):
+    """user_id получателей после чекпоинта по возрастанию, не больше limit."""
+    async with db_pool.acquire() as conn:
+        rows = await conn.stmt(f'broadcast_recipients_{audience}').fetch(after_user_id, limit, *_audience_args(days))
+    return [row['user_id'] for row in rows]
+
+async def db_broadcast_checkpoint(broadcast_id, owner, last_user_id, sent, failed, blocked, done=False):
+    """Возвращает статус рассылки или None, если ее подхватил другой процесс."""
+    async with db_pool.acquire() as conn:
+        return await conn.stmt('broadcast_checkpoint').fetchval(
+            broadcast_id, owner, last_user_id, sent, failed, blocked, done
+        )
+
+async def db_cancel_broadcast(broadcast_id):
+    async with db_pool.acquire() as conn:
+        return await conn.stmt('broadcast_cancel').fetchval(broadcast_id) is not None
+
+async def db_mark_blocked_users(user_ids):
+    if not user_ids:
+        return
+    async with db_pool.acquire() as conn:
+        await conn.stmt('users_mark_blocked').fetchval(list(user_ids))
@@ -3,6 +3,10 @@ from aiogram import Bot, Dispatcher, F, types
 from aiogram.filters import Command
 from database import db_complete_task_immediate, db_get_review, db_delete_review, db_update_balance
 from config import ADMIN_IDS, CURRENCY_NAME
+from monitoring import monitor_stats, api_bucket
+from notifier import notifier
+from outbound import outbound
+from broadcast import broadcaster, parse_audience, audience_title
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +25,64 @@ def register_admin_handlers(dp: Dispatcher, bot: Bot):
         except Exception as e:
             pass
 
+    @dp.message(Command("monitor"))
+    async def cmd_admin_monitor(message: types.Message):
+        if message.from_user.id not in ADMIN_IDS: return
+        await message.answer(
+            f"🛰 <b>Мониторинг отписок</b>\n\n"
+            f"Отставание от графика: <b>{int(monitor_stats['lag_seconds'])} с</b>\n"
+            f"Последний проход: {monitor_stats['last_batch']} подписок\n"
+            f"Проверок всего: {monitor_stats['checked']}\n"
+            f"Штрафов: {monitor_stats['penalized']}\n"
+            f"Ошибок: {monitor_stats['errors']}\n"
+            f"RetryAfter: {monitor_stats['retry_after']} (пауза {int(api_bucket.paused_for)} с)\n"
+            f"Уведомления: в очереди {notifier.pending}, отправлено {notifier.sent}, ошибок {notifier.failed}\n\n"
+            f"📤 <b>Исходящие запросы</b>\n" + "\n".join(
+                f"{lane}: в очереди {s['queued']}, всего {s['requests']}, "
+                f"ожидание ср. {s['avg_wait']:.2f} с / макс. {s['max_wait']:.2f} с"
+                for lane, s in outbound.stats().items()
+            ) + f"\nRetryAfter: {outbound.retry_after}",
+            parse_mode="HTML"
+        )
+
+    @dp.message(Command("broadcast"))
+    async def cmd_admin_broadcast(message: types.Message):
+        if message.from_user.id not in ADMIN_IDS: return
+        # Первая строка — команда и аудитория, дальше — текст (с форматированием админа)
+        header, _, text = message.html_text.partition("\n")
+        try:
+            audience, days = parse_audience(header.split()[1:])
+        except ValueError:
+            audience = None
+        if audience is None or not text.strip():
+            await message.answer(
+                "📣 <b>Рассылка</b>\n\n"
+                "<code>/broadcast АУДИТОРИЯ</code>\n<i>текст со следующей строки</i>\n\n"
+                "Аудитории:\n"
+                "<code>all</code> — все пользователи\n"
+                "<code>earned</code> — с заработанным балансом\n"
+                "<code>active N</code> — заходили за последние N дней\n\n"
+                "Остановить: <code>/broadcast_stop ID</code>",
+                parse_mode="HTML"
+            )
+            return
+
+        row = await broadcaster.create(message.from_user.id, audience, days, text.strip())
+        logger.info(f"Админ {message.from_user.id} запустил рассылку #{row['id']} "
+                    f"({audience_title(audience, days)}, получателей: {row['total']})")
+
+    @dp.message(Command("broadcast_stop"))
+    async def cmd_admin_broadcast_stop(message: types.Message):
+        if message.from_user.id not in ADMIN_IDS: return
+        parts = message.text.split()
+        if len(parts) < 2 or not parts[1].isdigit():
+            await message.answer("Использование: /broadcast_stop ID")
+            return
+        if await broadcaster.cancel(int(parts[1])):
+            await message.answer(f"🛑 Рассылка #{parts[1]} будет остановлена после текущей пачки.")
+        else:
+            await message.answer(f"Рассылка #{parts[1]} не найдена или уже завершена.")
+
     @dp.callback_query(F.data.startswith("admin_approve_"))
     async def process_admin_approve(callback: types.CallbackQuery):
         review_id = int(callback.data.split("_")[2])
@@ -3,14 +3,15 @@ import logging
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.types import ChatMemberUpdated, InlineKeyboardMarkup, InlineKeyboardButton
-from database import (
-    db_get_user, db_add_task, db_update_balance, db_get_my_tasks_paginated, db_pool
-)
+from database import db_purchase_task, db_get_my_tasks_paginated
 from keyboards import (
     get_ads_menu_kb, get_create_task_type_kb, get_cancel_kb, 
     get_back_to_ads_kb, get_paginated_kb, main_kb
 )
 from states import AppStates
+from pagination import BEFORE
+from chat_health import chat_health
+from runtime import runtime
 from utils import send_clean_message, safe_edit_message
 from config import (
     MIN_TASK_PRICE, MIN_VIEW_PRICE, MIN_REACTION_PRICE, MIN_BOT_PRICE, CURRENCY_NAME
@@ -18,9 +19,15 @@ from config import (
 
 logger = logging.getLogger(__name__)
 
-async def show_my_ads_page(callback, state: FSMContext, bot: Bot, page=1):
+async def show_my_ads_page(callback, state: FSMContext, bot: Bot, page=1, cursor=None):
     per_page = 5
-    tasks, total_count = await db_get_my_tasks_paginated(callback.from_user.id, page, per_page)
+    if not cursor:
+        page = 1
+    
+    tasks, total_count, has_next = await db_get_my_tasks_paginated(callback.from_user.id, cursor, per_page)
+    if cursor and (not tasks or (cursor.startswith(BEFORE) and len(tasks) < per_page)):
+        page = 1
+        tasks, total_count, has_next = await db_get_my_tasks_paginated(callback.from_user.id, None, per_page)
     
     if total_count == 0:
         await safe_edit_message(
@@ -30,8 +37,8 @@ async def show_my_ads_page(callback, state: FSMContext, bot: Bot, page=1):
         )
         return
 
-    text = "📂 <b>Ваши задания:</b>\n🟢 Активно | 🔴 Остановлено"
-    kb = get_paginated_kb(tasks, page, total_count, per_page, mode="myads")
+    text = "📂 <b>Ваши задания:</b>\n🟢 Активно | ⏸ Пауза (нет прав) | 🔴 Остановлено"
+    kb = get_paginated_kb(tasks, page, total_count, per_page, mode="myads", has_next=has_next)
     await safe_edit_message(callback.message, state, bot, text, reply_markup=kb)
 
 def register_advertise_handlers(dp: Dispatcher, bot: Bot):
@@ -39,10 +46,27 @@ def register_advertise_handlers(dp: Dispatcher, bot: Bot):
     @dp.my_chat_member()
     async def on_bot_channel_status_changed(event: ChatMemberUpdated, state: FSMContext):
         new_status = event.new_chat_member.status
+        chat = event.chat
+        if chat.type not in ("channel", "group", "supergroup"):
+            return
+
+        # Участников канала видит только админ; в группе getChatMember работает
+        # и у обычного участника — паузу вызывает только удаление бота
+        can_check = new_status == "administrator" or (
+            chat.type != "channel" and new_status in ("member", "restricted")
+        )
+        username = f"@{chat.username.lower()}" if chat.username else None
+        if not can_check:
+            # Бота разжаловали или удалили — проверять подписчиков больше нечем
+            if new_status in ("member", "restricted", "left", "kicked"):
+                await chat_health.trip(chat.id, f"статус бота: {new_status}", alias=username)
+            return
+
+        # Бот снова может проверять — задания чата, поставленные на паузу, возобновляются
+        await chat_health.reset(chat.id, username)
         if new_status != "administrator":
             return
 
-        chat = event.chat
         user = event.from_user
 
         if chat.type == "channel":
@@ -142,8 +166,8 @@ def register_advertise_handlers(dp: Dispatcher, bot: Bot):
         
         await state.update_data(ad_type=selected_type)
         
-        bot_info = await bot.get_me()
-        bot_username = bot_info.username
+        # Ссылки "добавить бота" собраны один раз при старте (runtime.warm_up)
+        await runtime.identity(bot)
 
         kb_rows = []
         
@@ -156,10 +180,8 @@ def register_advertise_handlers(dp: Dispatcher, bot: Bot):
                 "2️⃣ Затем отправьте ссылку на пост, где нужны реакции\n"
                 "(например: <code>https://t.me/durov/123</code>)"
             )
-            add_url_group = f"https://t.me/{bot_username}?startgroup&admin=invite_users+change_info+delete_messages"
-            add_url_channel = f"https://t.me/{bot_username}?startchannel&admin=post_messages+edit_messages+invite_users+change_info"
-            kb_rows.append([InlineKeyboardButton(text="➕ Добавить бота в группу", url=add_url_group)])
-            kb_rows.append([InlineKeyboardButton(text="➕ Добавить бота в канал", url=add_url_channel)])
+            kb_rows.append([InlineKeyboardButton(text="➕ Добавить бота в группу", url=runtime.add_to_group_url)])
+            kb_rows.append([InlineKeyboardButton(text="➕ Добавить бота в канал", url=runtime.add_to_channel_url)])
         elif selected_type == 'bot':
             msg = (
                 "🤖 <b>Реклама бота</b>\n\n"
@@ -172,8 +194,7 @@ def register_advertise_handlers(dp: Dispatcher, bot: Bot):
                 "Вы можете отправить ссылку (@group) вручную.\n"
                 "<b>ИЛИ</b> нажмите кнопку ниже, чтобы выбрать группу и добавить туда бота автоматически."
             )
-            add_url = f"https://t.me/{bot_username}?startgroup&admin=invite_users+change_info+delete_messages"
-            kb_rows.append([InlineKeyboardButton(text="➕ Добавить бота в группу", url=add_url)])
+            kb_rows.append([InlineKeyboardButton(text="➕ Добавить бота в группу", url=runtime.add_to_group_url)])
             
         else: # channel
             msg = (
@@ -181,8 +202,7 @@ def register_advertise_handlers(dp: Dispatcher, bot: Bot):
                 "Вы можете отправить ссылку (@channel) вручную.\n"
                 "<b>ИЛИ</b> нажмите кнопку ниже, чтобы выбрать канал и добавить туда бота автоматически."
             )
-            add_url = f"https://t.me/{bot_username}?startchannel&admin=post_messages+edit_messages+invite_users+change_info"
-            kb_rows.append([InlineKeyboardButton(text="➕ Добавить бота в канал", url=add_url)])
+            kb_rows.append([InlineKeyboardButton(text="➕ Добавить бота в канал", url=runtime.add_to_channel_url)])
         
         if selected_type not in ['bot', 'view', 'reaction']:
             msg += "\n\n⚠️ Бот должен быть администратором!"
@@ -328,6 +348,7 @@ def register_advertise_handlers(dp: Dispatcher, bot: Bot):
                 return
             
             chat_identifier = None
+            chat_id = None
             channel_title = "Unknown"
 
             # Предварительная подготовка данных (парсинг)
@@ -362,6 +383,10 @@ def register_advertise_handlers(dp: Dispatcher, bot: Bot):
                 try:
                     chat = await bot.get_chat(chat_identifier)
                     channel_title = chat.title
+                    chat_id = chat.id
+                    # Каноническая ссылка на канал/группу: @username, у частных — инвайт
+                    if ad_type in ('channel', 'group') and chat.username:
+                        link = f"@{chat.username}"
                     
                     if ad_type == 'group':
                         if chat.type not in ['group', 'supergroup']:
@@ -389,23 +414,16 @@ def register_advertise_handlers(dp: Dispatcher, bot: Bot):
                     return 
 
             cost = price * data['count']
-            balance, earned = await db_get_user(message.from_user.id)
-            total = balance + earned
+            # Проверка средств, списание и создание задания — одна транзакция в БД
+            task_id, balance, earned = await db_purchase_task(
+                message.from_user.id, link, channel_title, ad_type, price, data['count'], chat_id
+            )
             
-            if total < cost:
+            if task_id is None:
+                total = balance + earned
                 await send_clean_message(message, state, bot, f"❌ Не хватает средств. Нужно: {int(cost)} {CURRENCY_NAME}, у вас: {int(total)} {CURRENCY_NAME}")
                 await state.clear()
                 return
-            
-            if balance >= cost:
-                await db_update_balance(message.from_user.id, -cost, 'task_create', f'Задание {data["count"]} ({ad_type})', False)
-            else:
-                if balance > 0:
-                    await db_update_balance(message.from_user.id, -balance, 'task_create', 'Часть оплаты 1', False)
-                remaining = cost - balance
-                await db_update_balance(message.from_user.id, -remaining, 'task_create', 'Часть оплаты 2', True)
-            
-            task_id = await db_add_task(message.from_user.id, data['link'], channel_title, ad_type, price, data['count'])
 
             type_icon_map = {'view': '👁️', 'reaction': '❤️', 'channel': '📢', 'group': '👥', 'bot': '🤖'}
             icon = type_icon_map.get(ad_type, '📢')
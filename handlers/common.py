@@ -1,6 +1,6 @@
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.fsm.context import FSMContext
-from utils import delete_old_messages, send_clean_message, restore_keyboard
+from utils import reset_state, send_clean_message
 from keyboards import main_kb
 from handlers.earn import show_earn_list
 from handlers.advertise import show_my_ads_page
@@ -8,8 +8,7 @@ from handlers.advertise import show_my_ads_page
 def register_common_handlers(dp: Dispatcher, bot: Bot):
     @dp.callback_query(F.data == "cancel")
     async def cancel_handler(callback: types.CallbackQuery, state: FSMContext):
-        await delete_old_messages(callback.message.chat.id, state, bot)
-        await state.clear()
+        await reset_state(state)
         await send_clean_message(callback.message, state, bot, "Главное меню", reply_markup=main_kb)
         await callback.answer()
 
@@ -37,18 +36,20 @@ def register_common_handlers(dp: Dispatcher, bot: Bot):
 
     @dp.callback_query(F.data.startswith("page_"))
     async def process_pagination(callback: types.CallbackQuery, state: FSMContext):
+        # page_earn_<type>_<page>_<cursor> / page_myads_<page>_<cursor>
         parts = callback.data.split("_")
         mode = parts[1]
         
         if mode == "earn":
             task_type = parts[2]
             page = int(parts[3])
-            await show_earn_list(callback, state, bot, task_type, page)
+            cursor = parts[4] if len(parts) > 4 else None
+            await show_earn_list(callback, state, bot, task_type, page, cursor)
         elif mode == "myads":
             page = int(parts[2])
-            await show_my_ads_page(callback, state, bot, page)
+            cursor = parts[3] if len(parts) > 3 else None
+            await show_my_ads_page(callback, state, bot, page, cursor)
         
-        # Восстанавливаем клавиатуру после пагинации
-        await restore_keyboard(callback.message.chat.id, bot)
+        # Клавиатуру, если нужно, восстанавливает safe_edit_message (в фоне)
         await callback.answer()
 
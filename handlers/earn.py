@@ -1,11 +1,10 @@
 import logging
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.fsm.context import FSMContext
-import database  # <--- Импортируем модуль целиком
 from database import (
-    db_get_available_counts, db_get_tasks_paginated, 
-    db_complete_task_immediate, db_create_review, db_get_review, db_delete_review
-    # db_pool УБРАЛИ ОТСЮДА
+    db_get_available_counts, db_get_tasks_paginated, db_get_task,
+    db_complete_task_immediate, db_create_review, db_get_review, db_delete_review,
+    db_get_member_subscriptions, db_note_member_event
 )
 from keyboards import (
     get_earn_menu_kb, get_back_to_earn_menu_kb, get_paginated_kb, 
@@ -14,7 +13,11 @@ from keyboards import (
 from states import AppStates
 from utils import send_clean_message, safe_edit_message
 from config import UNSUB_CHECK_DAYS, CURRENCY_NAME
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from pagination import encode_cursor, task_key, BEFORE, START
+from membership import membership, task_chat, is_member_status
+from monitoring import apply_penalties
+from chat_health import chat_health
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ChatMemberUpdated
 
 logger = logging.getLogger(__name__)
 
@@ -39,11 +42,19 @@ async def show_earn_menu(message_or_call, state: FSMContext, bot: Bot):
     else:
         await safe_edit_message(message_or_call.message, state, bot, text, reply_markup=get_earn_menu_kb())
 
-async def show_earn_list(callback, state: FSMContext, bot: Bot, task_type, page=1):
+async def show_earn_list(callback, state: FSMContext, bot: Bot, task_type, page=1, cursor=None):
     per_page = 5
     user_id = callback.from_user.id
     
-    tasks, total_count = await db_get_tasks_paginated(user_id, task_type, page, per_page)
+    # Без курсора (или из старой кнопки) всегда начинаем с первой страницы
+    if not cursor:
+        page = 1
+    
+    tasks, total_count, has_next = await db_get_tasks_paginated(user_id, task_type, cursor, per_page)
+    if cursor and (not tasks or (cursor.startswith(BEFORE) and len(tasks) < per_page)):
+        # Страницы "съехали" (задания закончились) — показываем первую
+        page = 1
+        tasks, total_count, has_next = await db_get_tasks_paginated(user_id, task_type, None, per_page)
     
     type_name_map = {
         "channel": "каналы", 
@@ -54,7 +65,7 @@ async def show_earn_list(callback, state: FSMContext, bot: Bot, task_type, page=
     }
     type_name = type_name_map.get(task_type, "задания")
     
-    if total_count == 0:
+    if not tasks:
         text = f"😔 <b>Заданий ({type_name}) пока нет</b>\nПопробуйте зайти позже!"
         kb = get_back_to_earn_menu_kb()
     else:
@@ -69,10 +80,20 @@ async def show_earn_list(callback, state: FSMContext, bot: Bot, task_type, page=
             f"{desc}\n"
             "👇 Нажмите кнопку ссылки, затем кнопку подтверждения:"
         )
-        kb = get_paginated_kb(tasks, page, total_count, per_page, mode="earn", task_type=task_type)
+        kb = get_paginated_kb(tasks, page, total_count, per_page, mode="earn", task_type=task_type, has_next=has_next)
+        # Запоминаем начало страницы, чтобы после "✅ Проверить" перерисовать ее же
+        await state.update_data(earn_anchor=[task_type, page, encode_cursor(START, task_key(tasks[0]))])
     
     await safe_edit_message(callback.message, state, bot, text, reply_markup=kb)
 
+async def get_earn_anchor(state: FSMContext, task_type, page):
+    """Курсор текущей страницы списка (если пользователь все еще на ней)."""
+    data = await state.get_data()
+    anchor = data.get('earn_anchor')
+    if anchor and anchor[0] == task_type and anchor[1] == page:
+        return anchor[2]
+    return None
+
 def register_earn_handlers(dp: Dispatcher, bot: Bot):
     @dp.callback_query(F.data == "back_to_earn_menu")
     async def back_to_earn_menu_cb(callback: types.CallbackQuery, state: FSMContext):
@@ -106,13 +127,14 @@ def register_earn_handlers(dp: Dispatcher, bot: Bot):
         current_page = int(parts[2]) if len(parts) > 2 else 1
         task_type = parts[3] if len(parts) > 3 else "channel"
         
-        # ИСПРАВЛЕНИЕ: используем database.db_pool
-        async with database.db_pool.acquire() as conn:
-            task_data = await conn.fetchrow("SELECT channel_link, price_per_sub, channel_title FROM tasks WHERE id=$1", task_id)
+        task_data = await db_get_task(task_id)
         
-        if not task_data:
-            await callback.answer("❌ Задание не найдено", show_alert=True)
-            await show_earn_list(callback, state, bot, task_type, current_page)
+        if not task_data or task_data['paused']:
+            # Кнопка могла остаться от списка, отрисованного до паузы задания
+            text = "⏸ Задание приостановлено" if task_data else "❌ Задание не найдено"
+            await callback.answer(text, show_alert=True)
+            cursor = await get_earn_anchor(state, task_type, current_page)
+            await show_earn_list(callback, state, bot, task_type, current_page, cursor)
             return
 
         # --- ЛОГИКА ДЛЯ ПРОСМОТРОВ, РЕАКЦИЙ И БОТОВ ---
@@ -145,14 +167,13 @@ def register_earn_handlers(dp: Dispatcher, bot: Bot):
 
         # --- ЛОГИКА ДЛЯ ПОДПИСОК ---
         else:
-            channel_username = task_data['channel_link'].replace('@', '').replace('https://t.me/', '').strip('/')
-            can_complete = False
+            chat = task_chat(task_data)
             try:
-                member = await bot.get_chat_member(chat_id=f"@{channel_username}", user_id=callback.from_user.id)
-                if member.status in ['member', 'administrator', 'creator']:
-                    can_complete = True
+                can_complete = await membership.is_member(bot, chat, callback.from_user.id)
+                chat_health.record_success(chat)
             except Exception as e:
                 logger.error(f"Check error: {e}")
+                await chat_health.record_failure(chat, e)
                 await callback.answer("❌ Бот не видит подписку (проверьте, админ ли бот)", show_alert=True)
                 return
 
@@ -163,7 +184,8 @@ def register_earn_handlers(dp: Dispatcher, bot: Bot):
                     msg_text = message
                     msg_text += f"\n\n⚠️ Не отписывайтесь {UNSUB_CHECK_DAYS} дней, иначе штраф x2!"
                     await callback.answer(msg_text, show_alert=True)
-                    await show_earn_list(callback, state, bot, task_type, current_page)
+                    cursor = await get_earn_anchor(state, task_type, current_page)
+                    await show_earn_list(callback, state, bot, task_type, current_page, cursor)
                 else:
                      await callback.answer(f"❌ {message}", show_alert=True)
             else:
@@ -182,14 +204,16 @@ def register_earn_handlers(dp: Dispatcher, bot: Bot):
             
         user_id = message.from_user.id
         
-        # ИСПРАВЛЕНИЕ: используем database.db_pool
-        async with database.db_pool.acquire() as conn:
-            task_data = await conn.fetchrow("SELECT owner_id, task_type FROM tasks WHERE id=$1", task_id)
+        task_data = await db_get_task(task_id)
         
         if not task_data:
             await send_clean_message(message, state, bot, "❌ Задание не найдено.")
             await state.clear()
             return
+        if task_data['paused']:
+            await send_clean_message(message, state, bot, "⏸ Задание приостановлено, отчет не принят.")
+            await state.clear()
+            return
 
         owner_id = task_data['owner_id']
         task_type_str = task_data['task_type'].upper()
@@ -235,22 +259,16 @@ def register_earn_handlers(dp: Dispatcher, bot: Bot):
         from database import db_refund_penalty
         task_id = int(callback.data.split("_")[1])
         
-        # ИСПРАВЛЕНИЕ: используем database.db_pool
-        async with database.db_pool.acquire() as conn:
-            task = await conn.fetchrow(
-                "SELECT channel_link, price_per_sub FROM tasks WHERE id=$1", 
-                task_id
-            )
+        task = await db_get_task(task_id)
         
         if not task:
             await callback.answer("❌ Задание не найдено", show_alert=True)
             return
 
-        channel_username = task['channel_link'].replace('https://t.me/', '').replace('@', '').strip('/')
+        chat = task_chat(task)
         
         try:
-            member = await bot.get_chat_member(chat_id=f"@{channel_username}", user_id=callback.from_user.id)
-            if member.status in ['member', 'administrator', 'creator']:
+            if await membership.is_member(bot, chat, callback.from_user.id):
                 refund_amount = float(task['price_per_sub']) * 2
                 
                 success, msg = await db_refund_penalty(callback.from_user.id, task_id, refund_amount)
@@ -269,4 +287,26 @@ def register_earn_handlers(dp: Dispatcher, bot: Bot):
                 
         except Exception as e:
             logger.error(f"Restore error: {e}")
-            await callback.answer("❌ Ошибка проверки. Убедитесь, что бот админ в канале.", show_alert=True)
\ No newline at end of file
+            await chat_health.record_failure(chat, e)
+            await callback.answer("❌ Ошибка проверки. Убедитесь, что бот админ в канале.", show_alert=True)
+
+    # --- АПДЕЙТЫ УЧАСТНИКОВ ЧАТОВ (бот — админ) ---
+    @dp.chat_member()
+    async def on_chat_member_updated(event: ChatMemberUpdated):
+        chat_id = event.chat.id
+        # Юзернейм — для старых заданий, сохраненных без chat_id
+        chat = f"@{event.chat.username.lower()}" if event.chat.username else None
+        user_id = event.new_chat_member.user.id
+
+        # Статус изменился — закэшированный ответ get_chat_member больше не верен
+        membership.invalidate(chat_id, user_id)
+        if chat:
+            membership.invalidate(chat, user_id)
+        # Апдейты из этого чата доходят — мониторинг может проверять его реже
+        await db_note_member_event(chat_id, chat)
+
+        # Интересует только выход из чата
+        if is_member_status(event.new_chat_member) or not is_member_status(event.old_chat_member):
+            return
+
+        await apply_penalties(await db_get_member_subscriptions(user_id, chat_id, chat))
@@ -1,14 +1,13 @@
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
-from utils import delete_old_messages, send_clean_message
+from utils import reset_state, send_clean_message
 from database import db_get_user, db_get_global_stats
 from keyboards import main_kb
 from config import CURRENCY_NAME
 
 async def cmd_start(message: types.Message, state: FSMContext, bot: Bot):
-    await delete_old_messages(message.chat.id, state, bot)
-    await state.clear()
+    await reset_state(state)
     
     await db_get_user(message.from_user.id)
     users_count, tasks_today = await db_get_global_stats()
@@ -40,22 +39,19 @@ def register_main_menu_handlers(dp: Dispatcher, bot: Bot):
     @dp.message(F.text == "💰 Заработать", StateFilter("*"))
     async def cmd_earn(message: types.Message, state: FSMContext):
         from handlers.earn import show_earn_menu
-        await delete_old_messages(message.chat.id, state, bot)
-        await state.clear()
+        await reset_state(state)
         await show_earn_menu(message, state, bot)
 
     @dp.message(F.text == "📢 Рекламировать", StateFilter("*"))
     async def cmd_advertise_menu(message: types.Message, state: FSMContext):
         from keyboards import get_ads_menu_kb
-        await delete_old_messages(message.chat.id, state, bot)
-        await state.clear()
+        await reset_state(state)
         await send_clean_message(message, state, bot, "📢 <b>Раздел рекламы</b>", reply_markup=get_ads_menu_kb())
 
     @dp.message(F.text == "👤 Кабинет", StateFilter("*"))
     async def cmd_profile(message: types.Message, state: FSMContext):
         from keyboards import get_deposit_kb
-        await delete_old_messages(message.chat.id, state, bot)
-        await state.clear()
+        await reset_state(state)
         
         balance, earned_balance = await db_get_user(message.from_user.id)
         total = balance + earned_balance
@@ -73,8 +69,7 @@ def register_main_menu_handlers(dp: Dispatcher, bot: Bot):
 
     @dp.message(F.text == "📖 Инструкция", StateFilter("*"))
     async def cmd_instruction(message: types.Message, state: FSMContext):
-        await delete_old_messages(message.chat.id, state, bot)
-        await state.clear()
+        await reset_state(state)
         
         await send_clean_message(
             message, state, bot,
@@ -85,8 +80,7 @@ def register_main_menu_handlers(dp: Dispatcher, bot: Bot):
 
     @dp.message(F.text == "📋 Условия", StateFilter("*"))
     async def cmd_conditions(message: types.Message, state: FSMContext):
-        await delete_old_messages(message.chat.id, state, bot)
-        await state.clear()
+        await reset_state(state)
         
         await send_clean_message(
             message, state, bot,
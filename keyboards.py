@@ -2,7 +2,9 @@ from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton, 
     InlineKeyboardMarkup, InlineKeyboardButton
 )
+from cache import TTLCache
 from config import CURRENCY_NAME, STARS_TO_FCOINS_RATE
+from pagination import encode_cursor, task_key, AFTER, BEFORE
 
 # --- KEYBOARDS ---
 main_kb = ReplyKeyboardMarkup(
@@ -17,63 +19,109 @@ main_kb = ReplyKeyboardMarkup(
     input_field_placeholder="Меню"
 )
 
+# Статические клавиатуры собираются один раз при импорте и разделяются всеми
+# апдейтами. Вызывающий код не должен их изменять.
+
+DEPOSIT_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="⭐ Купить FCOINS (Stars)", callback_data="topup_stars")],
+    [InlineKeyboardButton(text="🔙 Вернуться", callback_data="back_to_start")]
+])
+
+STARS_AMOUNTS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=f"50 ⭐ ({int(50 * STARS_TO_FCOINS_RATE)} {CURRENCY_NAME})", callback_data="stars_50")],
+    [InlineKeyboardButton(text=f"100 ⭐ ({int(100 * STARS_TO_FCOINS_RATE)} {CURRENCY_NAME})", callback_data="stars_100")],
+    [InlineKeyboardButton(text=f"200 ⭐ ({int(200 * STARS_TO_FCOINS_RATE)} {CURRENCY_NAME})", callback_data="stars_200")],
+    [InlineKeyboardButton(text="✏️ Ввести своё кол-во", callback_data="stars_custom")],
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_profile_cb")]
+])
+
+ADS_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="➕ Создать задание", callback_data="ad_new")],
+    [InlineKeyboardButton(text="📂 Мои задания", callback_data="ad_list")],
+    [InlineKeyboardButton(text="🔙 Вернуться", callback_data="back_to_start")]
+])
+
+CREATE_TASK_TYPE_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📢 Канал", callback_data="type_channel"), InlineKeyboardButton(text="👥 Группа", callback_data="type_group")],
+    [InlineKeyboardButton(text="🤖 Бот", callback_data="type_bot")],
+    [InlineKeyboardButton(text="👁️ Просмотры", callback_data="type_view"), InlineKeyboardButton(text="❤️ Реакции", callback_data="type_reaction")],
+    [InlineKeyboardButton(text="❌ Отмена", callback_data="ad_menu")]
+])
+
+EARN_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📢 Подписаться на канал", callback_data="earn_channel")],
+    [InlineKeyboardButton(text="👥 Вступить в группу", callback_data="earn_group")],
+    [InlineKeyboardButton(text="🤖 Запустить бота", callback_data="earn_bot")],
+    [InlineKeyboardButton(text="👁️ Смотреть посты", callback_data="earn_view")],
+    [InlineKeyboardButton(text="❤️ Ставить реакции", callback_data="earn_reaction")],
+    [InlineKeyboardButton(text="🔙 Вернуться", callback_data="back_to_start")]
+])
+
+BACK_TO_EARN_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_earn_menu")]
+])
+
+BACK_TO_ADS_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="ad_menu")]
+])
+
+CANCEL_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
+])
+
 # --- HELPERS FOR KEYBOARDS ---
 def get_deposit_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⭐ Купить FCOINS (Stars)", callback_data="topup_stars")],
-        [InlineKeyboardButton(text="🔙 Вернуться", callback_data="back_to_start")]
-    ])
+    return DEPOSIT_KB
 
 def get_stars_amounts_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"50 ⭐ ({int(50 * STARS_TO_FCOINS_RATE)} {CURRENCY_NAME})", callback_data="stars_50")],
-        [InlineKeyboardButton(text=f"100 ⭐ ({int(100 * STARS_TO_FCOINS_RATE)} {CURRENCY_NAME})", callback_data="stars_100")],
-        [InlineKeyboardButton(text=f"200 ⭐ ({int(200 * STARS_TO_FCOINS_RATE)} {CURRENCY_NAME})", callback_data="stars_200")],
-        [InlineKeyboardButton(text="✏️ Ввести своё кол-во", callback_data="stars_custom")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_profile_cb")]
-    ])
+    return STARS_AMOUNTS_KB
 
 def get_ads_menu_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➕ Создать задание", callback_data="ad_new")],
-        [InlineKeyboardButton(text="📂 Мои задания", callback_data="ad_list")],
-        [InlineKeyboardButton(text="🔙 Вернуться", callback_data="back_to_start")]
-    ])
+    return ADS_MENU_KB
 
 def get_create_task_type_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📢 Канал", callback_data="type_channel"), InlineKeyboardButton(text="👥 Группа", callback_data="type_group")],
-        [InlineKeyboardButton(text="🤖 Бот", callback_data="type_bot")],
-        [InlineKeyboardButton(text="👁️ Просмотры", callback_data="type_view"), InlineKeyboardButton(text="❤️ Реакции", callback_data="type_reaction")],
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="ad_menu")]
-    ])
+    return CREATE_TASK_TYPE_KB
 
 def get_earn_menu_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📢 Подписаться на канал", callback_data="earn_channel")],
-        [InlineKeyboardButton(text="👥 Вступить в группу", callback_data="earn_group")],
-        [InlineKeyboardButton(text="🤖 Запустить бота", callback_data="earn_bot")],
-        [InlineKeyboardButton(text="👁️ Смотреть посты", callback_data="earn_view")],
-        [InlineKeyboardButton(text="❤️ Ставить реакции", callback_data="earn_reaction")],
-        [InlineKeyboardButton(text="🔙 Вернуться", callback_data="back_to_start")]
-    ])
+    return EARN_MENU_KB
 
 def get_back_to_earn_menu_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_earn_menu")]
-    ])
+    return BACK_TO_EARN_MENU_KB
 
 def get_back_to_ads_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="ad_menu")]
-    ])
+    return BACK_TO_ADS_KB
 
 def get_cancel_kb():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")]
-    ])
+    return CANCEL_KB
+
+# --- ПАГИНИРОВАННЫЕ СПИСКИ ---
+# Страница "💰 Заработать" у всех пользователей одна и та же, пока не изменились
+# задания на ней, поэтому готовая клавиатура кэшируется по содержимому: поля
+# заданий, от которых зависят кнопки и курсоры, плюс номер страницы и тип.
+PAGINATED_KB_CACHE_SIZE = 2048
+
+_paginated_kb_cache = TTLCache(ttl=3600, maxsize=PAGINATED_KB_CACHE_SIZE)
+
+_EARN_KEY_FIELDS = ('id', 'price_per_sub', 'created_at', 'channel_title', 'channel_link')
+_MYADS_KEY_FIELDS = ('id', 'created_at', 'channel_title', 'task_type', 'active', 'paused', 'count_done', 'count_needed')
+
+
+def _paginated_kb_key(tasks, page, total_count, per_page, mode, task_type, has_next):
+    fields = _EARN_KEY_FIELDS if mode == "earn" else _MYADS_KEY_FIELDS
+    rows = tuple(tuple(task[field] for field in fields) for task in tasks)
+    return (mode, task_type, page, total_count, per_page, has_next, rows)
+
+
+def get_paginated_kb(tasks, page, total_count, per_page, mode="earn", task_type="channel", has_next=False):
+    key = _paginated_kb_key(tasks, page, total_count, per_page, mode, task_type, has_next)
+    kb = _paginated_kb_cache.get(key)
+    if kb is None:
+        kb = _build_paginated_kb(tasks, page, total_count, per_page, mode, task_type, has_next)
+        _paginated_kb_cache.set(key, kb)
+    return kb
+
 
-def get_paginated_kb(tasks, page, total_count, per_page, mode="earn", task_type="channel"):
+def _build_paginated_kb(tasks, page, total_count, per_page, mode, task_type, has_next):
     builder = InlineKeyboardMarkup(inline_keyboard=[])
     rows = []
 
@@ -119,6 +167,7 @@ def get_paginated_kb(tasks, page, total_count, per_page, mode="earn", task_type=
         
         elif mode == "myads": 
             status = "🟢" if task['active'] and task['count_done'] < task['count_needed'] else "🔴"
+            if status == "🟢" and task['paused']: status = "⏸"
             title = task['channel_title']
             
             icon = "📢"
@@ -138,21 +187,25 @@ def get_paginated_kb(tasks, page, total_count, per_page, mode="earn", task_type=
 
     builder.inline_keyboard = rows
 
-    total_pages = (total_count + per_page - 1) // per_page
+    # Keyset-пагинация: в кнопках лежит курсор от первой/последней строки страницы
+    total_pages = max((total_count + per_page - 1) // per_page, page)
+    total_pages = max(total_pages, page + 1) if has_next else page
     if total_pages > 1:
         pagination_row = []
         key = f"{mode}"
         if mode == "earn": key += f"_{task_type}"
 
-        if page > 1:
-            pagination_row.append(InlineKeyboardButton(text="⬅️", callback_data=f"page_{key}_{page-1}"))
+        if page > 1 and tasks:
+            prev_cursor = encode_cursor(BEFORE, task_key(tasks[0], mode))
+            pagination_row.append(InlineKeyboardButton(text="⬅️", callback_data=f"page_{key}_{page-1}_{prev_cursor}"))
         else:
             pagination_row.append(InlineKeyboardButton(text="⏺️", callback_data="ignore"))
         
         pagination_row.append(InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data="ignore"))
         
-        if page < total_pages:
-            pagination_row.append(InlineKeyboardButton(text="➡️", callback_data=f"page_{key}_{page+1}"))
+        if has_next and tasks:
+            next_cursor = encode_cursor(AFTER, task_key(tasks[-1], mode))
+            pagination_row.append(InlineKeyboardButton(text="➡️", callback_data=f"page_{key}_{page+1}_{next_cursor}"))
         else:
             pagination_row.append(InlineKeyboardButton(text="⏺️", callback_data="ignore"))
             
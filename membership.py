@@ -0,0 +1,112 @@
+import asyncio
+import logging
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# --- ПРОВЕРКА ПОДПИСКИ (get_chat_member) ---
+# Единая точка для кнопки "✅ Проверить", возврата штрафа и мониторинга отписок.
+# Положительный ответ кэшируется ненадолго, одинаковые одновременные запросы
+# склеиваются в один (single-flight). Апдейты chat_member сбрасывают запись.
+
+MEMBER_CACHE_TTL = 60  # секунд
+
+
+def normalize_chat(link):
+    """
+    Ссылка задания -> идентификатор чата для Bot API ("@username").
+    Для частных инвайт-ссылок (t.me/+..., joinchat) возвращает None —
+    по ним get_chat_member не работает.
+    """
+    if not link:
+        return None
+    target = link.strip()
+    for prefix in ('https://', 'http://'):
+        if target.startswith(prefix):
+            target = target[len(prefix):]
+    for prefix in ('www.', 't.me/', 'telegram.me/'):
+        if target.startswith(prefix):
+            target = target[len(prefix):]
+    target = target.split('?')[0].strip('/').lstrip('@')
+    if not target or target.startswith('+') or target.startswith('joinchat'):
+        return None
+    # t.me/name/123 — пост канала, проверяем подписку на сам канал
+    target = target.split('/')[0]
+    # Юзернеймы в Telegram регистронезависимы
+    return f"@{target.lower()}"
+
+
+def task_chat(task):
+    """Чат задания для get_chat_member: числовой chat_id, у старых заданий — "@username"."""
+    return task['chat_id'] or normalize_chat(task['channel_link'])
+
+
+def is_member_status(member):
+    if member.status in ('member', 'administrator', 'creator'):
+        return True
+    # Ограниченный участник остается в чате, пока is_member = True
+    return member.status == 'restricted' and bool(getattr(member, 'is_member', False))
+
+
+class MembershipChecker:
+    def __init__(self, ttl=MEMBER_CACHE_TTL, maxsize=50000):
+        self._cache = TTLCache(ttl, maxsize=maxsize)
+        self._inflight = {}     # (chat, user_id) -> Future с результатом текущего запроса
+
+    async def is_member(self, bot, chat, user_id, bucket=None):
+        """
+        Состоит ли user_id в чате chat (результат task_chat: chat_id или "@username").
+        Ошибки Bot API пробрасываются вызывающему (бот не админ, RetryAfter и т.п.).
+        bucket — TokenBucket вызывающего (мониторинг); попадание в кэш токен не тратит.
+        """
+        if chat is None:
+            raise ValueError("Частная ссылка: проверка подписки недоступна")
+        key = (chat, user_id)
+        if self._cache.get(key):
+            return True
+
+        # Токен берем до регистрации в _inflight: интерактивная проверка, присоединившись
+        # к чужому запросу, не должна ждать очереди мониторинга (api_bucket)
+        if bucket is not None:
+            await bucket.acquire()
+            if self._cache.get(key):
+                return True
+
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise       # отменили нас самих
+                # Отменили ведущий запрос (остановка мониторинга и т.п.) — проверяем сами
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            member = await bot.get_chat_member(chat_id=chat, user_id=user_id)
+            result = is_member_status(member)
+            # Кэшируем только "подписан": отрицательный ответ должен перепроверяться сразу
+            if result:
+                self._cache.set(key, True)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже доставлено ожидающим; без этого asyncio ругается в лог
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, chat, user_id):
+        self._cache.pop((chat, user_id))
+
+
+membership = MembershipChecker()
@@ -0,0 +1,687 @@
+import logging
+from config import UNSUB_CHECK_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-lock, под которым выполняются миграции.
+# Два экземпляра бота, стартующие одновременно, не смогут применить одну миграцию дважды.
+MIGRATION_LOCK_ID = 7_301_245_001
+
+# --- МИГРАЦИИ ---
+# Список упорядочен по номеру версии. Уже выпущенные миграции НЕ редактируются —
+# любое изменение схемы оформляется новой миграцией в конце списка.
+MIGRATIONS = [
+    (1, "Базовые таблицы", '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            balance NUMERIC(10, 4) DEFAULT 0.0,
+            earned_balance NUMERIC(10, 4) DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+
+        CREATE TABLE IF NOT EXISTS invoices (
+            invoice_id TEXT PRIMARY KEY,
+            user_id BIGINT,
+            amount NUMERIC(10, 4),
+            payment_type TEXT DEFAULT 'stars',
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+
+        CREATE TABLE IF NOT EXISTS tasks (
+            id SERIAL PRIMARY KEY,
+            owner_id BIGINT,
+            channel_link TEXT,
+            channel_title TEXT,
+            task_type TEXT DEFAULT 'channel',
+            price_per_sub NUMERIC(10, 4),
+            count_needed INTEGER,
+            count_done INTEGER DEFAULT 0,
+            active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+
+        CREATE TABLE IF NOT EXISTS completed (
+            user_id BIGINT,
+            task_id INTEGER,
+            completed_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (user_id, task_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id BIGINT,
+            task_id INTEGER,
+            subscribed_at TIMESTAMP DEFAULT NOW(),
+            checked_at TIMESTAMP,
+            rewarded BOOLEAN DEFAULT TRUE,
+            penalized BOOLEAN DEFAULT FALSE,
+            PRIMARY KEY (user_id, task_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS transactions (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            amount NUMERIC(10, 4),
+            type TEXT,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+
+        CREATE TABLE IF NOT EXISTS pending_reviews (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            task_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+    '''),
+
+    (2, "Индексы для списков заданий, статистики и мониторинга", '''
+        -- Открытые задания для "💰 Заработать": фильтр по типу + сортировка по цене
+        CREATE INDEX IF NOT EXISTS idx_tasks_open
+            ON tasks (task_type, price_per_sub DESC, created_at DESC)
+            WHERE active = TRUE;
+
+        -- "📂 Мои задания"
+        CREATE INDEX IF NOT EXISTS idx_tasks_owner
+            ON tasks (owner_id, created_at DESC);
+
+        -- "Выполнено заданий сегодня" на /start
+        CREATE INDEX IF NOT EXISTS idx_completed_at
+            ON completed (completed_at);
+
+        -- Выборка мониторинга отписок: только подписки без штрафа
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_unpenalized
+            ON subscriptions (subscribed_at)
+            WHERE penalized = FALSE;
+
+        -- Заявки на проверку скриншотов конкретного задания
+        CREATE INDEX IF NOT EXISTS idx_pending_reviews_task
+            ON pending_reviews (task_id, user_id);
+    '''),
+
+    (3, "Индексы под keyset-пагинацию (id как последний ключ)", '''
+        DROP INDEX IF EXISTS idx_tasks_open;
+        CREATE INDEX idx_tasks_open
+            ON tasks (task_type, price_per_sub DESC, created_at DESC, id DESC)
+            WHERE active = TRUE;
+
+        DROP INDEX IF EXISTS idx_tasks_owner;
+        CREATE INDEX idx_tasks_owner
+            ON tasks (owner_id, created_at DESC, id DESC);
+    '''),
+
+    (4, "Уведомления для каталога заданий в памяти (LISTEN task_catalog)", '''
+        CREATE OR REPLACE FUNCTION notify_task_catalog() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('task_catalog', json_build_object('op', 'delete', 'id', OLD.id)::text);
+                RETURN OLD;
+            END IF;
+            PERFORM pg_notify('task_catalog', json_build_object('op', 'upsert', 'task', row_to_json(NEW))::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS tasks_notify_catalog ON tasks;
+        CREATE TRIGGER tasks_notify_catalog
+            AFTER INSERT OR UPDATE OR DELETE ON tasks
+            FOR EACH ROW EXECUTE PROCEDURE notify_task_catalog();
+
+        CREATE OR REPLACE FUNCTION notify_completed_catalog() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('task_catalog', json_build_object(
+                    'op', 'uncompleted', 'user_id', OLD.user_id, 'task_id', OLD.task_id)::text);
+                RETURN OLD;
+            END IF;
+            PERFORM pg_notify('task_catalog', json_build_object(
+                'op', 'completed', 'user_id', NEW.user_id, 'task_id', NEW.task_id)::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS completed_notify_catalog ON completed;
+        CREATE TRIGGER completed_notify_catalog
+            AFTER INSERT OR DELETE ON completed
+            FOR EACH ROW EXECUTE PROCEDURE notify_completed_catalog();
+    '''),
+
+    (5, "Серверная функция complete_task (выполнение задания за один round trip)", '''
+        CREATE OR REPLACE FUNCTION complete_task(p_user_id BIGINT, p_task_id INTEGER)
+        RETURNS TABLE (ok BOOLEAN, reason TEXT, price NUMERIC, task_kind TEXT, exhausted BOOLEAN) AS $$
+        DECLARE
+            t RECORD;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM completed c WHERE c.user_id = p_user_id AND c.task_id = p_task_id) THEN
+                RETURN QUERY SELECT FALSE, 'already_done'::TEXT, NULL::NUMERIC, NULL::TEXT, FALSE;
+                RETURN;
+            END IF;
+
+            SELECT tk.count_done, tk.count_needed, tk.active, tk.price_per_sub, tk.task_type
+            INTO t
+            FROM tasks tk WHERE tk.id = p_task_id
+            FOR UPDATE;
+
+            IF NOT FOUND OR NOT t.active OR t.count_done >= t.count_needed THEN
+                RETURN QUERY SELECT FALSE, 'unavailable'::TEXT, NULL::NUMERIC, NULL::TEXT, FALSE;
+                RETURN;
+            END IF;
+
+            -- 1. Добавляем в completed
+            INSERT INTO completed (user_id, task_id) VALUES (p_user_id, p_task_id);
+
+            -- 2. Мониторинг (только подписки на каналы/группы)
+            IF t.task_type NOT IN ('view', 'reaction', 'bot') THEN
+                INSERT INTO subscriptions (user_id, task_id, subscribed_at, rewarded)
+                VALUES (p_user_id, p_task_id, NOW(), TRUE)
+                ON CONFLICT (user_id, task_id) DO UPDATE SET subscribed_at = NOW(), rewarded = TRUE;
+            END IF;
+
+            -- 3. Счетчик задания
+            UPDATE tasks SET count_done = count_done + 1 WHERE id = p_task_id;
+
+            -- 4. Баланс исполнителя
+            UPDATE users SET earned_balance = earned_balance + t.price_per_sub WHERE user_id = p_user_id;
+
+            -- 5. Транзакция
+            INSERT INTO transactions (user_id, amount, type, description)
+            VALUES (p_user_id, t.price_per_sub, 'task_earn',
+                    format('Выполнение задания #%s (%s)', p_task_id, t.task_type));
+
+            RETURN QUERY SELECT TRUE, NULL::TEXT, t.price_per_sub, t.task_type::TEXT,
+                                t.count_done + 1 >= t.count_needed;
+        END;
+        $$ LANGUAGE plpgsql;
+    '''),
+
+    (6, "complete_task возвращает новый баланс исполнителя (для кэша балансов)", '''
+        DROP FUNCTION IF EXISTS complete_task(BIGINT, INTEGER);
+        CREATE FUNCTION complete_task(p_user_id BIGINT, p_task_id INTEGER)
+        RETURNS TABLE (ok BOOLEAN, reason TEXT, price NUMERIC, task_kind TEXT, exhausted BOOLEAN,
+                       new_balance NUMERIC, new_earned NUMERIC) AS $$
+        DECLARE
+            t RECORD;
+            v_balance NUMERIC;
+            v_earned NUMERIC;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM completed c WHERE c.user_id = p_user_id AND c.task_id = p_task_id) THEN
+                RETURN QUERY SELECT FALSE, 'already_done'::TEXT, NULL::NUMERIC, NULL::TEXT, FALSE,
+                                    NULL::NUMERIC, NULL::NUMERIC;
+                RETURN;
+            END IF;
+
+            SELECT tk.count_done, tk.count_needed, tk.active, tk.price_per_sub, tk.task_type
+            INTO t
+            FROM tasks tk WHERE tk.id = p_task_id
+            FOR UPDATE;
+
+            IF NOT FOUND OR NOT t.active OR t.count_done >= t.count_needed THEN
+                RETURN QUERY SELECT FALSE, 'unavailable'::TEXT, NULL::NUMERIC, NULL::TEXT, FALSE,
+                                    NULL::NUMERIC, NULL::NUMERIC;
+                RETURN;
+            END IF;
+
+            -- 1. Добавляем в completed
+            INSERT INTO completed (user_id, task_id) VALUES (p_user_id, p_task_id);
+
+            -- 2. Мониторинг (только подписки на каналы/группы)
+            IF t.task_type NOT IN ('view', 'reaction', 'bot') THEN
+                INSERT INTO subscriptions (user_id, task_id, subscribed_at, rewarded)
+                VALUES (p_user_id, p_task_id, NOW(), TRUE)
+                ON CONFLICT (user_id, task_id) DO UPDATE SET subscribed_at = NOW(), rewarded = TRUE;
+            END IF;
+
+            -- 3. Счетчик задания
+            UPDATE tasks SET count_done = count_done + 1 WHERE id = p_task_id;
+
+            -- 4. Баланс исполнителя
+            UPDATE users u SET earned_balance = u.earned_balance + t.price_per_sub
+            WHERE u.user_id = p_user_id
+            RETURNING u.balance, u.earned_balance INTO v_balance, v_earned;
+
+            -- 5. Транзакция
+            INSERT INTO transactions (user_id, amount, type, description)
+            VALUES (p_user_id, t.price_per_sub, 'task_earn',
+                    format('Выполнение задания #%s (%s)', p_task_id, t.task_type));
+
+            RETURN QUERY SELECT TRUE, NULL::TEXT, t.price_per_sub, t.task_type::TEXT,
+                                t.count_done + 1 >= t.count_needed, v_balance, v_earned;
+        END;
+        $$ LANGUAGE plpgsql;
+    '''),
+
+    (7, "Счетчики статистики /start (bot_stats), поддерживаемые триггерами", '''
+        CREATE TABLE IF NOT EXISTS bot_stats (
+            key TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        );
+
+        -- Одна строка на день: "выполнено сегодня" переключается сменой даты
+        CREATE TABLE IF NOT EXISTS bot_stats_daily (
+            day DATE PRIMARY KEY,
+            completed BIGINT NOT NULL DEFAULT 0
+        );
+
+        CREATE OR REPLACE FUNCTION bot_stats_users() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                UPDATE bot_stats SET value = value - 1 WHERE key = 'users';
+                RETURN OLD;
+            END IF;
+            UPDATE bot_stats SET value = value + 1 WHERE key = 'users';
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS users_bot_stats ON users;
+        CREATE TRIGGER users_bot_stats
+            AFTER INSERT OR DELETE ON users
+            FOR EACH ROW EXECUTE PROCEDURE bot_stats_users();
+
+        CREATE OR REPLACE FUNCTION bot_stats_completed() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO bot_stats_daily (day, completed) VALUES (NEW.completed_at::date, 1)
+            ON CONFLICT (day) DO UPDATE SET completed = bot_stats_daily.completed + 1;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS completed_bot_stats ON completed;
+        CREATE TRIGGER completed_bot_stats
+            AFTER INSERT ON completed
+            FOR EACH ROW EXECUTE PROCEDURE bot_stats_completed();
+
+        -- Начальные значения. Триггеры уже созданы и держат блокировку таблиц
+        -- до конца миграции, поэтому между подсчетом и триггером ничего не теряется.
+        INSERT INTO bot_stats (key, value)
+        SELECT 'users', COUNT(*) FROM users
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;
+
+        INSERT INTO bot_stats_daily (day, completed)
+        SELECT completed_at::date, COUNT(*) FROM completed
+        WHERE completed_at >= CURRENT_DATE
+        GROUP BY completed_at::date
+        ON CONFLICT (day) DO UPDATE SET completed = EXCLUDED.completed;
+    '''),
+
+    (8, "Серверная функция purchase_task (оплата и создание задания атомарно)", '''
+        CREATE OR REPLACE FUNCTION purchase_task(
+            p_owner_id BIGINT, p_link TEXT, p_title TEXT, p_task_type TEXT,
+            p_price NUMERIC, p_count INTEGER
+        )
+        RETURNS TABLE (new_task_id INTEGER, new_balance NUMERIC, new_earned NUMERIC) AS $$
+        DECLARE
+            v_balance NUMERIC;
+            v_earned NUMERIC;
+            v_cost NUMERIC := p_price * p_count;
+            v_from_balance NUMERIC;
+            v_task_id INTEGER;
+        BEGIN
+            SELECT u.balance, u.earned_balance INTO v_balance, v_earned
+            FROM users u WHERE u.user_id = p_owner_id
+            FOR UPDATE;
+
+            IF NOT FOUND THEN
+                INSERT INTO users (user_id) VALUES (p_owner_id)
+                RETURNING users.balance, users.earned_balance INTO v_balance, v_earned;
+            END IF;
+
+            IF v_balance + v_earned < v_cost THEN
+                RETURN QUERY SELECT NULL::INTEGER, v_balance, v_earned;
+                RETURN;
+            END IF;
+
+            -- Сначала списываем пополненный баланс, остаток — с заработанного
+            IF v_balance >= v_cost THEN
+                UPDATE users SET balance = balance - v_cost WHERE user_id = p_owner_id;
+                INSERT INTO transactions (user_id, amount, type, description)
+                VALUES (p_owner_id, -v_cost, 'task_create', format('Задание %s (%s)', p_count, p_task_type));
+            ELSE
+                v_from_balance := GREATEST(v_balance, 0);
+                IF v_from_balance > 0 THEN
+                    UPDATE users SET balance = balance - v_from_balance WHERE user_id = p_owner_id;
+                    INSERT INTO transactions (user_id, amount, type, description)
+                    VALUES (p_owner_id, -v_from_balance, 'task_create', 'Часть оплаты 1');
+                END IF;
+                UPDATE users SET earned_balance = earned_balance - (v_cost - v_from_balance)
+                WHERE user_id = p_owner_id;
+                INSERT INTO transactions (user_id, amount, type, description)
+                VALUES (p_owner_id, -(v_cost - v_from_balance), 'task_create', 'Часть оплаты 2');
+            END IF;
+
+            INSERT INTO tasks (owner_id, channel_link, channel_title, task_type, price_per_sub, count_needed)
+            VALUES (p_owner_id, p_link, p_title, p_task_type, p_price, p_count)
+            RETURNING id INTO v_task_id;
+
+            RETURN QUERY
+            SELECT v_task_id, u.balance, u.earned_balance FROM users u WHERE u.user_id = p_owner_id;
+        END;
+        $$ LANGUAGE plpgsql;
+    '''),
+
+    (9, "Очередь проверок подписок (subscriptions.next_check_at)", f'''
+        ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS next_check_at TIMESTAMP;
+
+        -- Новая (или повторная) подписка ставится в очередь на первую проверку через минуту
+        CREATE OR REPLACE FUNCTION schedule_subscription_check() RETURNS trigger AS $$
+        BEGIN
+            IF NOT NEW.penalized THEN
+                NEW.next_check_at := NEW.subscribed_at + INTERVAL '1 minute';
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS subscriptions_schedule_check ON subscriptions;
+        CREATE TRIGGER subscriptions_schedule_check
+            BEFORE INSERT OR UPDATE OF subscribed_at ON subscriptions
+            FOR EACH ROW EXECUTE PROCEDURE schedule_subscription_check();
+
+        UPDATE subscriptions SET next_check_at = LOCALTIMESTAMP
+        WHERE penalized = FALSE AND rewarded = TRUE
+        AND subscribed_at > LOCALTIMESTAMP - INTERVAL '{UNSUB_CHECK_DAYS} days';
+
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_due
+            ON subscriptions (next_check_at)
+            WHERE next_check_at IS NOT NULL;
+
+        -- Мониторинг больше не сканирует подписки по дате
+        DROP INDEX IF EXISTS idx_subscriptions_unpenalized;
+    '''),
+
+    (10, "Апдейты chat_member: chat_key() и tasks.member_event_at", '''
+        -- Последний апдейт chat_member из чата задания. Свежая отметка значит, что бот
+        -- админ и получает выходы участников сам — опрос таких чатов можно разрядить.
+        ALTER TABLE tasks ADD COLUMN IF NOT EXISTS member_event_at TIMESTAMP;
+
+        -- Ссылка задания -> "@username" (как membership.normalize_chat), NULL для инвайтов
+        CREATE OR REPLACE FUNCTION chat_key(link TEXT) RETURNS TEXT AS $$
+            SELECT CASE
+                WHEN k = '' OR k LIKE '+%' OR k LIKE 'joinchat%' THEN NULL
+                ELSE '@' || split_part(k, '/', 1)
+            END
+            FROM (
+                SELECT ltrim(btrim(regexp_replace(
+                    split_part(lower(btrim(link)), '?', 1),
+                    '^(https?://)?(www[.])?(t[.]me/|telegram[.]me/)?', ''
+                ), '/'), '@') AS k
+            ) AS normalized
+        $$ LANGUAGE sql IMMUTABLE;
+
+        CREATE INDEX IF NOT EXISTS idx_tasks_chat_key ON tasks (chat_key(channel_link));
+    '''),
+
+    (11, "tasks.chat_id: числовой id чата задания", '''
+        -- Проверки подписки идут по числовому id: без разбора ссылок и резолва юзернеймов,
+        -- и чаты по инвайт-ссылке тоже можно проверять. Старые задания без chat_id
+        -- заполняет мониторинг при старте (backfill_task_chat_ids).
+        ALTER TABLE tasks ADD COLUMN IF NOT EXISTS chat_id BIGINT;
+        CREATE INDEX IF NOT EXISTS idx_tasks_chat_id ON tasks (chat_id) WHERE chat_id IS NOT NULL;
+
+        DROP FUNCTION IF EXISTS purchase_task(BIGINT, TEXT, TEXT, TEXT, NUMERIC, INTEGER);
+        CREATE FUNCTION purchase_task(
+            p_owner_id BIGINT, p_link TEXT, p_title TEXT, p_task_type TEXT,
+            p_price NUMERIC, p_count INTEGER, p_chat_id BIGINT
+        )
+        RETURNS TABLE (new_task_id INTEGER, new_balance NUMERIC, new_earned NUMERIC) AS $$
+        DECLARE
+            v_balance NUMERIC;
+            v_earned NUMERIC;
+            v_cost NUMERIC := p_price * p_count;
+            v_from_balance NUMERIC;
+            v_task_id INTEGER;
+        BEGIN
+            SELECT u.balance, u.earned_balance INTO v_balance, v_earned
+            FROM users u WHERE u.user_id = p_owner_id
+            FOR UPDATE;
+
+            IF NOT FOUND THEN
+                INSERT INTO users (user_id) VALUES (p_owner_id)
+                RETURNING users.balance, users.earned_balance INTO v_balance, v_earned;
+            END IF;
+
+            IF v_balance + v_earned < v_cost THEN
+                RETURN QUERY SELECT NULL::INTEGER, v_balance, v_earned;
+                RETURN;
+            END IF;
+
+            -- Сначала списываем пополненный баланс, остаток — с заработанного
+            IF v_balance >= v_cost THEN
+                UPDATE users SET balance = balance - v_cost WHERE user_id = p_owner_id;
+                INSERT INTO transactions (user_id, amount, type, description)
+                VALUES (p_owner_id, -v_cost, 'task_create', format('Задание %s (%s)', p_count, p_task_type));
+            ELSE
+                v_from_balance := GREATEST(v_balance, 0);
+                IF v_from_balance > 0 THEN
+                    UPDATE users SET balance = balance - v_from_balance WHERE user_id = p_owner_id;
+                    INSERT INTO transactions (user_id, amount, type, description)
+                    VALUES (p_owner_id, -v_from_balance, 'task_create', 'Часть оплаты 1');
+                END IF;
+                UPDATE users SET earned_balance = earned_balance - (v_cost - v_from_balance)
+                WHERE user_id = p_owner_id;
+                INSERT INTO transactions (user_id, amount, type, description)
+                VALUES (p_owner_id, -(v_cost - v_from_balance), 'task_create', 'Часть оплаты 2');
+            END IF;
+
+            INSERT INTO tasks (owner_id, channel_link, channel_title, task_type, price_per_sub, count_needed, chat_id)
+            VALUES (p_owner_id, p_link, p_title, p_task_type, p_price, p_count, p_chat_id)
+            RETURNING id INTO v_task_id;
+
+            RETURN QUERY
+            SELECT v_task_id, u.balance, u.earned_balance FROM users u WHERE u.user_id = p_owner_id;
+        END;
+        $$ LANGUAGE plpgsql;
+    '''),
+
+    (12, "tasks.paused: пауза заданий недоступных чатов", '''
+        -- Ставит chat_health, когда бот потерял права в чате; снимается при возврате админки
+        ALTER TABLE tasks ADD COLUMN IF NOT EXISTS paused BOOLEAN NOT NULL DEFAULT FALSE;
+
+        DROP INDEX IF EXISTS idx_tasks_open;
+        CREATE INDEX idx_tasks_open
+            ON tasks (task_type, price_per_sub DESC, created_at DESC, id DESC)
+            WHERE active = TRUE AND paused = FALSE;
+    '''),
+
+    (13, "Аренда подписок воркерами мониторинга (lease_owner, lease_until)", '''
+        -- Воркер забирает пачку due-подписок в аренду (FOR UPDATE SKIP LOCKED) и
+        -- снимает ее при переносе проверки. Аренда умершего воркера истекает сама.
+        ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS lease_owner TEXT;
+        ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP;
+    '''),
+    (14, "Рассылки: users.last_seen_at, blocked_users, broadcasts (чекпоинты)", '''
+        -- Аудитория "активные за N дней". Без индекса: обновление остается HOT,
+        -- а рассылке хватает последовательного прохода по users.
+        -- Колонка добавляется без DEFAULT: иначе все существующие пользователи
+        -- получили бы время миграции и считались активными. Для них берем created_at
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP;
+        UPDATE users SET last_seen_at = created_at WHERE last_seen_at IS NULL;
+        ALTER TABLE users ALTER COLUMN last_seen_at SET DEFAULT NOW();
+
+        -- Пользователи, заблокировавшие бота. Вернувшийся пользователь (last_seen_at
+        -- позже blocked_at) снова попадает в рассылки
+        CREATE TABLE IF NOT EXISTS blocked_users (
+            user_id BIGINT PRIMARY KEY,
+            blocked_at TIMESTAMP DEFAULT NOW()
+        );
+
+        -- Рассылка идет по user_id по возрастанию; last_user_id — чекпоинт,
+        -- с которого продолжает процесс, подхвативший рассылку после падения
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            admin_id BIGINT NOT NULL,
+            audience TEXT NOT NULL,
+            audience_days INT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            owner TEXT,
+            total INT NOT NULL DEFAULT 0,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INT NOT NULL DEFAULT 0,
+            failed INT NOT NULL DEFAULT 0,
+            blocked INT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT NOW(),
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_running ON broadcasts(updated_at) WHERE status = 'running';
+    '''),
+    (15, "Подписки приостановленных заданий вне очереди проверок", '''
+        -- next_check_at = infinity: due-скан subscriptions_lease до них не доходит.
+        -- tasks_resume_chat возвращает их в очередь
+        UPDATE subscriptions s SET next_check_at = 'infinity'
+        FROM tasks t
+        WHERE s.task_id = t.id AND t.paused = TRUE AND s.next_check_at IS NOT NULL;
+
+        CREATE OR REPLACE FUNCTION schedule_subscription_check() RETURNS trigger AS $$
+        BEGIN
+            IF NOT NEW.penalized THEN
+                IF EXISTS (SELECT 1 FROM tasks t WHERE t.id = NEW.task_id AND t.paused) THEN
+                    NEW.next_check_at := 'infinity';
+                ELSE
+                    NEW.next_check_at := NEW.subscribed_at + INTERVAL '1 minute';
+                END IF;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    '''),
+    (16, "complete_task: задания на паузе недоступны", '''
+        -- Кнопка из списка, отрисованного до паузы, не должна начислять награду за
+        -- чат, который бот больше не может проверять
+        CREATE OR REPLACE FUNCTION complete_task(p_user_id BIGINT, p_task_id INTEGER)
+        RETURNS TABLE (ok BOOLEAN, reason TEXT, price NUMERIC, task_kind TEXT, exhausted BOOLEAN,
+                       new_balance NUMERIC, new_earned NUMERIC) AS $$
+        DECLARE
+            t RECORD;
+            v_balance NUMERIC;
+            v_earned NUMERIC;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM completed c WHERE c.user_id = p_user_id AND c.task_id = p_task_id) THEN
+                RETURN QUERY SELECT FALSE, 'already_done'::TEXT, NULL::NUMERIC, NULL::TEXT, FALSE,
+                                    NULL::NUMERIC, NULL::NUMERIC;
+                RETURN;
+            END IF;
+
+            SELECT tk.count_done, tk.count_needed, tk.active, tk.paused, tk.price_per_sub, tk.task_type
+            INTO t
+            FROM tasks tk WHERE tk.id = p_task_id
+            FOR UPDATE;
+
+            IF NOT FOUND OR NOT t.active OR t.paused OR t.count_done >= t.count_needed THEN
+                RETURN QUERY SELECT FALSE, 'unavailable'::TEXT, NULL::NUMERIC, NULL::TEXT, FALSE,
+                                    NULL::NUMERIC, NULL::NUMERIC;
+                RETURN;
+            END IF;
+
+            -- 1. Добавляем в completed
+            INSERT INTO completed (user_id, task_id) VALUES (p_user_id, p_task_id);
+
+            -- 2. Мониторинг (только подписки на каналы/группы)
+            IF t.task_type NOT IN ('view', 'reaction', 'bot') THEN
+                INSERT INTO subscriptions (user_id, task_id, subscribed_at, rewarded)
+                VALUES (p_user_id, p_task_id, NOW(), TRUE)
+                ON CONFLICT (user_id, task_id) DO UPDATE SET subscribed_at = NOW(), rewarded = TRUE;
+            END IF;
+
+            -- 3. Счетчик задания
+            UPDATE tasks SET count_done = count_done + 1 WHERE id = p_task_id;
+
+            -- 4. Баланс исполнителя
+            UPDATE users u SET earned_balance = u.earned_balance + t.price_per_sub
+            WHERE u.user_id = p_user_id
+            RETURNING u.balance, u.earned_balance INTO v_balance, v_earned;
+
+            -- 5. Транзакция
+            INSERT INTO transactions (user_id, amount, type, description)
+            VALUES (p_user_id, t.price_per_sub, 'task_earn',
+                    format('Выполнение задания #%s (%s)', p_task_id, t.task_type));
+
+            RETURN QUERY SELECT TRUE, NULL::TEXT, t.price_per_sub, t.task_type::TEXT,
+                                t.count_done + 1 >= t.count_needed, v_balance, v_earned;
+        END;
+        $$ LANGUAGE plpgsql;
+    '''),
+    (17, "Шардированные счетчики bot_stats: без общей блокировки строки на запись", '''
+        -- Раньше каждое выполнение и каждая регистрация обновляли одну и ту же строку
+        -- (день / 'users') внутри транзакции вызывающего — все записи шли по очереди.
+        -- Теперь соединение пишет в свой шард (pg_backend_pid() % 16), чтение суммирует шарды
+        ALTER TABLE bot_stats ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0;
+        ALTER TABLE bot_stats DROP CONSTRAINT IF EXISTS bot_stats_pkey;
+        ALTER TABLE bot_stats ADD PRIMARY KEY (key, shard);
+
+        ALTER TABLE bot_stats_daily ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0;
+        ALTER TABLE bot_stats_daily DROP CONSTRAINT IF EXISTS bot_stats_daily_pkey;
+        ALTER TABLE bot_stats_daily ADD PRIMARY KEY (day, shard);
+
+        CREATE OR REPLACE FUNCTION bot_stats_users() RETURNS trigger AS $$
+        DECLARE
+            delta BIGINT := CASE WHEN TG_OP = 'DELETE' THEN -1 ELSE 1 END;
+        BEGIN
+            INSERT INTO bot_stats (key, shard, value) VALUES ('users', pg_backend_pid() % 16, delta)
+            ON CONFLICT (key, shard) DO UPDATE SET value = bot_stats.value + delta;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION bot_stats_completed() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO bot_stats_daily (day, shard, completed)
+            VALUES (NEW.completed_at::date, pg_backend_pid() % 16, 1)
+            ON CONFLICT (day, shard) DO UPDATE SET completed = bot_stats_daily.completed + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    '''),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(conn):
+    """Текущая версия схемы (0, если таблицы schema_version еще нет)."""
+    exists = await conn.fetchval("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not exists:
+        return 0
+    version = await conn.fetchval("SELECT MAX(version) FROM schema_version")
+    return version or 0
+
+
+async def migrate(conn):
+    """
+    Доводит схему до LATEST_VERSION.
+    Если схема актуальна — только чтение версии (два коротких SELECT), без DDL и без блокировок.
+    """
+    version = await get_schema_version(conn)
+    if version >= LATEST_VERSION:
+        logger.info(f"✅ Схема БД актуальна (версия {version})")
+        return version
+
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+    try:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT NOW()
+            );
+        ''')
+        # Перечитываем под блокировкой: другой экземпляр мог уже всё применить
+        version = await get_schema_version(conn)
+
+        for number, description, sql in MIGRATIONS:
+            if number <= version:
+                continue
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+                    number, description
+                )
+            logger.info(f"Миграция {number} применена: {description}")
+            version = number
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+    logger.info(f"✅ Схема БД обновлена до версии {version}")
+    return version
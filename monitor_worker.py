@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+from aiogram import Bot
+from config import TOKEN, BOT_PROCESSES, MONITOR_PROCESSES
+import database
+import monitoring
+from database import init_db
+from monitoring import monitor_unsubscribes
+from notifier import notifier
+from outbound import outbound
+from ratelimit import TokenBucket
+
+# --- ОТДЕЛЬНЫЕ ПРОЦЕССЫ МОНИТОРИНГА ОТПИСОК ---
+# python monitor_worker.py --workers 4
+# Воркеры берут due-подписки в аренду (FOR UPDATE SKIP LOCKED), поэтому их можно
+# запускать сколько угодно и на разных хостах. У бота при этом RUN_MONITOR=0
+# и MONITOR_PROCESSES=N (общий лимит Bot API делится на всех).
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+async def run_worker(index, rate, workers):
+    # Лимит Bot API общий на токен — делим его между процессами: проверки
+    # get_chat_member между воркерами мониторинга, исходящие сообщения (штрафы,
+    # уведомления владельцам) — еще и с процессами бота
+    monitoring.api_bucket = TokenBucket(rate=rate, capacity=max(1, int(rate)))
+    outbound.share(BOT_PROCESSES + workers)
+    bot = Bot(token=TOKEN)
+    bot.session.middleware(outbound)
+    await init_db(with_catalog=False)
+    notifier.start(bot)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    try:
+        # chat_id старых заданий заполняет только первый воркер
+        await monitor_unsubscribes(bot, worker_id=worker_id, backfill=(index == 0))
+    finally:
+        await notifier.stop()
+        await bot.session.close()
+        if database.db_pool:
+            await database.db_pool.close()
+
+
+def _process_main(index, rate, workers):
+    try:
+        asyncio.run(run_worker(index, rate, workers))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркеры мониторинга отписок")
+    parser.add_argument("--workers", type=int, default=max(1, MONITOR_PROCESSES), help="число процессов")
+    parser.add_argument("--rate", type=float, default=20, help="запросов get_chat_member в секунду на все процессы")
+    args = parser.parse_args()
+    rate = args.rate / max(1, args.workers)
+    if args.workers != MONITOR_PROCESSES:
+        # Бот делит лимит исходящих исходя из MONITOR_PROCESSES
+        logger.warning(f"MONITOR_PROCESSES={MONITOR_PROCESSES}, а запущено воркеров: {args.workers}. "
+                       f"Задайте MONITOR_PROCESSES={args.workers} и для бота")
+
+    if args.workers <= 1:
+        _process_main(0, rate, args.workers)
+        return
+
+    processes = [
+        multiprocessing.Process(target=_process_main, args=(index, rate, args.workers), name=f"monitor-{index}")
+        for index in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено воркеров мониторинга: {len(processes)}")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
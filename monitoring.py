@@ -1,111 +1,282 @@
 import asyncio
 import logging
+import os
+import socket
+from collections import deque
+from datetime import timedelta
 from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import database  # <--- Импортируем весь модуль, чтобы видеть обновления переменной
-from database import db_apply_penalty
+from database import (
+    db_apply_penalties, db_lease_due_subscriptions, db_reschedule_subscriptions,
+    db_get_chats_without_id, db_set_chat_id
+)
 from config import UNSUB_CHECK_DAYS, CURRENCY_NAME
+from ratelimit import TokenBucket
+from membership import membership, task_chat
+from chat_health import chat_health
+from notifier import notifier
 
 logger = logging.getLogger(__name__)
 
+# Адаптивный график проверок: (возраст подписки до, интервал проверки).
+# Отписываются чаще всего в первые часы, поэтому первый день проверяем плотно,
+# а к концу срока UNSUB_CHECK_DAYS — редко.
+CHECK_CADENCE = [
+    (timedelta(hours=1), timedelta(minutes=2)),
+    (timedelta(days=1), timedelta(minutes=10)),
+    (timedelta(days=2), timedelta(minutes=30)),
+    (timedelta(days=3), timedelta(hours=1)),
+    (None, timedelta(hours=3)),
+]
+# Чаты, откуда приходят апдейты chat_member: выход ловит обработчик в handlers/earn.py,
+# опрос остается редкой сверкой на случай пропущенного апдейта
+EVENTS_TRUSTED_FOR = timedelta(days=1)     # сколько доверяем последнему апдейту
+RECONCILE_INTERVAL = timedelta(hours=12)
+ERROR_RETRY_DELAY = timedelta(minutes=10)  # если проверить не удалось (бот не админ и т.п.)
+MONITOR_TICK = 15                          # секунд между опросами очереди
+MONITOR_BATCH = 500                        # строк за один проход
+MONITOR_CONCURRENCY = 16                   # одновременных запросов get_chat_member
+MONITOR_LEASE_SECONDS = 300                # аренда пачки; у упавшего воркера истечет сама
+LAG_WARNING_SECONDS = 300                  # предупреждать, если отставание больше
+
+# Общий лимит Bot API ~30 запросов/с на бота; мониторингу отдаем часть,
+# чтобы ответы пользователям не упирались во флуд-лимит
+api_bucket = TokenBucket(rate=20, capacity=20)
+
+def next_check_time(subscribed_at, now, delay=None):
+    """Следующая проверка подписки или None, если срок мониторинга вышел."""
+    deadline = subscribed_at + timedelta(days=UNSUB_CHECK_DAYS)
+    if delay is None:
+        age = now - subscribed_at
+        delay = next(interval for limit, interval in CHECK_CADENCE if limit is None or age < limit)
+    next_at = min(now + delay, deadline - timedelta(minutes=1))
+    return next_at if next_at > now else None
+
+def _fair_order(subs):
+    """
+    Чередует подписки разных каналов (round-robin), чтобы один большой канал
+    не занимал все запросы прохода, пока остальные ждут.
+    """
+    by_chat = {}
+    for sub in subs:
+        by_chat.setdefault(task_chat(sub), deque()).append(sub)
+    queues = deque(by_chat.values())
+    while queues:
+        chat_subs = queues.popleft()
+        yield chat_subs.popleft()
+        if chat_subs:
+            queues.append(chat_subs)
+
+# --- СОСТОЯНИЕ МОНИТОРИНГА (для /monitor) ---
+monitor_stats = {
+    'lag_seconds': 0.0,     # насколько самая старая проверка прохода опоздала к своему сроку
+    'last_batch': 0,        # подписок в последнем проходе
+    'checked': 0,           # всего запросов get_chat_member
+    'penalized': 0,
+    'errors': 0,
+    'retry_after': 0,       # сколько раз Telegram ответил RetryAfter
+}
+
+async def _check_member(bot: Bot, chat, user_id):
+    """True/False — состоит ли юзер в канале; исключение — проверить не удалось."""
+    while True:
+        try:
+            result = await membership.is_member(bot, chat, user_id, bucket=api_bucket)
+            monitor_stats['checked'] += 1
+            return result
+        except TelegramRetryAfter as e:
+            # Флуд-лимит: тормозим всех воркеров сразу и повторяем этот же запрос
+            monitor_stats['retry_after'] += 1
+            logger.warning(f"RetryAfter {e.retry_after}с при проверке подписок, пауза")
+            api_bucket.pause(e.retry_after)
+
+async def apply_penalties(subs):
+    """
+    Штрафы за отписку пачкой (один запрос к БД) и уведомления с кнопками возврата.
+    Общий путь для мониторинга и апдейтов chat_member. Возвращает число наложенных штрафов.
+    """
+    if not subs:
+        return 0
+    
+    # Списываем деньги в БД
+    applied = await db_apply_penalties([
+        (sub['user_id'], sub['task_id'], float(sub['price_per_sub']) * 2, sub['channel_title'] or "Канал")
+        for sub in subs
+    ])
+    count = len(applied)
+    monitor_stats['penalized'] += count
+    
+    for sub in subs:
+        key = (sub['user_id'], sub['task_id'])
+        if key not in applied:
+            continue
+        applied.discard(key)
+        
+        user_id, task_id = key
+        channel_link = sub['channel_link']
+        title = sub['channel_title'] or "Канал"
+        penalty = float(sub['price_per_sub']) * 2
+        logger.info(f"📉 Штраф применен к {user_id} за отписку от {title}")
+        
+        if not channel_link.startswith('http'):
+            valid_url = f"https://t.me/{channel_link.replace('@', '')}"
+        else:
+            valid_url = channel_link
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔗 Подписаться обратно", url=valid_url)], # Используем валидный URL
+            [InlineKeyboardButton(text="🔄 Я подписался (Вернуть деньги)", callback_data=f"restore_{task_id}")]
+            ])
+        
+        # Отправка в фоне: проход мониторинга не ждет Telegram
+        notifier.send(
+            user_id,
+            (
+                f"🚨 <b>ОБНАРУЖЕНА ОТПИСКА!</b>\n\n"
+                f"<b>Канал:</b> {title}\n"
+                f"Вы нарушили правило обязательной подписки ({UNSUB_CHECK_DAYS} дней).\n\n"
+                f"❌ <b>Списан штраф: -{int(penalty)} {CURRENCY_NAME}</b>\n\n"
+                f"<i>Вернитесь в канал и нажмите кнопку ниже, чтобы вернуть средства.</i>"
+            ),
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+    return count
+
+async def _process_sub(bot: Bot, sub, schedule, unsubscribed):
+    """Проверяет одну подписку: следующий срок проверки — в schedule, отписка — в unsubscribed."""
+    user_id = sub['user_id']
+    task_id = sub['task_id']
+    now = sub['db_now']
+    
+    # Просмотры/реакции/боты и подписки с истекшим сроком не мониторятся
+    if sub['task_type'] in ('view', 'reaction', 'bot') or next_check_time(sub['subscribed_at'], now) is None:
+        schedule.append((user_id, task_id, None))
+        return
+    
+    chat = task_chat(sub)
+    
+    # Частная ссылка без сохраненного chat_id (старые задания) — проверить нечем
+    if chat is None:
+        logger.debug(f"Пропуск проверки для частной ссылки: {sub['channel_link']}")
+        schedule.append((user_id, task_id, None))
+        return
+
+    # Чат только что поставлен на паузу: остальные подписки пачки не дергают API
+    if chat_health.is_open(chat):
+        schedule.append((user_id, task_id, next_check_time(sub['subscribed_at'], now, ERROR_RETRY_DELAY)))
+        return
+
+    try:
+        is_member = await _check_member(bot, chat, user_id)
+    except Exception as e:
+        # Если бот не админ в канале, Телеграм выдаст ошибку "Chat not found" или "Not enough rights".
+        # Несколько таких ошибок подряд — задания чата на паузу, подписки выпадут из очереди
+        if await chat_health.record_failure(chat, e):
+            schedule.append((user_id, task_id, next_check_time(sub['subscribed_at'], now, ERROR_RETRY_DELAY)))
+            return
+        monitor_stats['errors'] += 1
+        logger.error(f"Ошибка проверки юзера {user_id} в {chat}: {e}")
+        # Важно: если мы не смогли проверить (например, бот не админ), 
+        # мы НЕ штрафуем, а откладываем проверку
+        schedule.append((user_id, task_id, next_check_time(sub['subscribed_at'], now, ERROR_RETRY_DELAY)))
+        return
+
+    chat_health.record_success(chat)
+    if is_member:
+        event_at = sub['member_event_at']
+        delay = RECONCILE_INTERVAL if event_at and now - event_at < EVENTS_TRUSTED_FOR else None
+        schedule.append((user_id, task_id, next_check_time(sub['subscribed_at'], now, delay)))
+        return
+
+    # Обнаружена отписка. Штрафы пачки накладываются одним запросом в конце прохода
+    unsubscribed.append(sub)
+
+async def _run_batch(bot: Bot, subs, worker_id):
+    """Проверяет пачку подписок пулом из MONITOR_CONCURRENCY воркеров."""
+    queue = asyncio.Queue()
+    for sub in _fair_order(subs):
+        queue.put_nowait(sub)
+    schedule = []
+    unsubscribed = []
+
+    async def worker():
+        while True:
+            try:
+                sub = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await _process_sub(bot, sub, schedule, unsubscribed)
+            except Exception as e:
+                logger.error(f"Ошибка обработки подписки {sub['user_id']}/{sub['task_id']}: {e}")
+
+    await asyncio.gather(*(worker() for _ in range(min(MONITOR_CONCURRENCY, len(subs)))))
+    # Штрафованные подписки снимаются с очереди в db_apply_penalties
+    await apply_penalties(unsubscribed)
+    await db_reschedule_subscriptions(worker_id, schedule)
+
+async def backfill_task_chat_ids(bot: Bot):
+    """Разово сохраняет chat_id для заданий, созданных до появления tasks.chat_id."""
+    chats = await db_get_chats_without_id()
+    if not chats:
+        return
+    logger.info(f"Заполняем chat_id для {len(chats)} чатов старых заданий")
+    for chat in chats:
+        try:
+            await api_bucket.acquire()
+            info = await bot.get_chat(chat)
+            await db_set_chat_id(chat, info.id)
+        except TelegramRetryAfter as e:
+            api_bucket.pause(e.retry_after)
+        except Exception as e:
+            # Чат удален или бот не видит его — остается проверка по юзернейму
+            logger.warning(f"Не удалось получить chat_id для {chat}: {e}")
+
 # --- ФОНОВАЯ ЗАДАЧА: МОНИТОРИНГ ОТПИСОК (5 ДНЕЙ) ---
-async def monitor_unsubscribes(bot: Bot):
-    """Проверяет подписки за последние 5 дней"""
-    logger.info("🚀 Мониторинг отписок запущен")
+async def monitor_unsubscribes(bot: Bot, worker_id=None, backfill=True):
+    """
+    Проверяет подписки из очереди проверок (только те, чей срок наступил).
+    Можно запускать в нескольких процессах/на нескольких хостах (monitor_worker.py):
+    каждый воркер берет пачки в аренду, одна подписка проверяется одним воркером.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"🚀 Мониторинг отписок запущен ({worker_id})")
+    chat_ids_filled = not backfill
     
     while True:
         try:
-            # Ждем перед следующей проверкой
-            await asyncio.sleep(60) 
-            
             if database.db_pool is None:
                 logger.warning("DB pool еще не инициализирован, ожидание...")
                 await asyncio.sleep(10)
                 continue
             
-            # Запрос: берем только те записи, по которым еще не было штрафа
-            query = f'''
-                SELECT s.user_id, s.task_id, t.channel_link, t.channel_title, t.price_per_sub, t.task_type
-                FROM subscriptions s
-                JOIN tasks t ON s.task_id = t.id
-                WHERE s.subscribed_at > NOW() - INTERVAL '{UNSUB_CHECK_DAYS} days'
-                AND s.penalized = FALSE
-                AND s.rewarded = TRUE
-                AND t.task_type NOT IN ('view', 'reaction', 'bot')
-            '''
-
-            async with database.db_pool.acquire() as conn:
-                recent_subs = await conn.fetch(query)
+            if not chat_ids_filled:
+                await backfill_task_chat_ids(bot)
+                chat_ids_filled = True
+
+            due_subs = await db_lease_due_subscriptions(worker_id, MONITOR_BATCH, MONITOR_LEASE_SECONDS)
             
-            if not recent_subs:
+            if not due_subs:
+                monitor_stats['lag_seconds'] = 0.0
+                await asyncio.sleep(MONITOR_TICK)
                 continue
 
-            for sub in recent_subs:
-                user_id = sub['user_id']
-                channel_link = sub['channel_link']
-                task_id = sub['task_id']
-                title = sub['channel_title'] or "Канал"
-                
-                # 1. Форматируем username для проверки
-                # Убираем лишние символы из ссылки
-                clean_target = channel_link.replace('https://t.me/', '').replace('@', '').split('?')[0].strip('/')
-                
-                # Если ссылка частная (содержит + или joinchat), get_chat_member не сработает по юзернейму
-                if '+' in clean_target or 'joinchat' in clean_target:
-                    logger.debug(f"Пропуск проверки для частной ссылки: {clean_target}")
-                    continue
-
-                is_member = False
-                try:
-                    # Пытаемся получить статус участника
-                    member = await bot.get_chat_member(chat_id=f"@{clean_target}", user_id=user_id)
-                    
-                    if member.status in ['member', 'administrator', 'creator', 'restricted']:
-                        is_member = True
-                        
-                except Exception as e:
-                    # Если бот не админ в канале, Телеграм выдаст ошибку "Chat not found" или "Not enough rights"
-                    logger.error(f"Ошибка проверки юзера {user_id} в {clean_target}: {e}")
-                    # Важно: если мы не смогли проверить (например, бот не админ), 
-                    # мы НЕ штрафуем, а просто идем дальше
-                    continue 
-
-                # 2. Если обнаружена отписка
-                if not is_member:
-                    penalty = float(sub['price_per_sub']) * 2
-                    
-                    # Списываем деньги в БД
-                    success = await db_apply_penalty(user_id, task_id, penalty, title)
-                    
-                    if success:
-                        logger.info(f"📉 Штраф применен к {user_id} за отписку от {title}")
-                        
-                        if not channel_link.startswith('http'):
-                            valid_url = f"https://t.me/{channel_link.replace('@', '')}"
-                        else:
-                            valid_url = channel_link
-                        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text="🔗 Подписаться обратно", url=valid_url)], # Используем валидный URL
-                            [InlineKeyboardButton(text="🔄 Я подписался (Вернуть деньги)", callback_data=f"restore_{task_id}")]
-                            ])
-                        
-                        try:
-                            # Отправляем сообщение
-                            await bot.send_message(
-                                chat_id=user_id,
-                                text=(
-                                    f"🚨 <b>ОБНАРУЖЕНА ОТПИСКА!</b>\n\n"
-                                    f"<b>Канал:</b> {title}\n"
-                                    f"Вы нарушили правило обязательной подписки ({UNSUB_CHECK_DAYS} дней).\n\n"
-                                    f"❌ <b>Списан штраф: -{int(penalty)} {CURRENCY_NAME}</b>\n\n"
-                                    f"<i>Вернитесь в канал и нажмите кнопку ниже, чтобы вернуть средства.</i>"
-                                ),
-                                reply_markup=keyboard,
-                                parse_mode="HTML"
-                            )
-                        except Exception as send_error:
-                            logger.warning(f"Сообщение о штрафе не доставлено юзеру {user_id} (возможно бот в бане): {send_error}")
+            # Сильнее всех опаздывает подписка с самым ранним next_check_at
+            oldest = min(due_subs, key=lambda sub: sub['next_check_at'])
+            lag = (oldest['db_now'] - oldest['next_check_at']).total_seconds()
+            monitor_stats['lag_seconds'] = max(0.0, lag)
+            monitor_stats['last_batch'] = len(due_subs)
+            if lag > LAG_WARNING_SECONDS:
+                logger.warning(f"Мониторинг отстает от графика на {int(lag)}с")
+
+            await _run_batch(bot, due_subs, worker_id)
+
+            # Полная пачка — возможно, в очереди есть еще просроченные проверки
+            if len(due_subs) < MONITOR_BATCH:
+                await asyncio.sleep(MONITOR_TICK)
 
         except Exception as global_e:
             logger.error(f"Критическая ошибка в мониторинге: {global_e}")
-            await asyncio.sleep(30) # Пауза перед рестартом при ошибке
\ No newline at end of file
+            await asyncio.sleep(30) # Пауза перед рестартом при ошибке
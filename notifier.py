@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+from outbound import outbound_priority, LOW
+
+logger = logging.getLogger(__name__)
+
+# --- ФОНОВАЯ ОТПРАВКА УВЕДОМЛЕНИЙ ---
+# Мониторинг и обработчики кладут сообщение в очередь и идут дальше.
+# Воркеры отправляют в низкой полосе планировщика outbound: лимиты Bot API
+# и RetryAfter обрабатывает он, интерактивные ответы проходят первыми.
+
+SENDER_WORKERS = 4
+QUEUE_SIZE = 10000
+
+
+class NotificationSender:
+    def __init__(self):
+        self._queue = None
+        self._workers = []
+        self._bot = None
+        self.sent = 0
+        self.failed = 0
+
+    def start(self, bot: Bot, workers=SENDER_WORKERS):
+        self._bot = bot
+        self._queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    async def stop(self, timeout=10):
+        """Дает очереди догрузиться (не дольше timeout секунд) и останавливает воркеров."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено уведомлений при остановке: {self._queue.qsize()}")
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def send(self, chat_id, text, **kwargs):
+        """Ставит bot.send_message(chat_id, text, **kwargs) в очередь, не дожидаясь отправки."""
+        if self._queue is None:
+            logger.error("NotificationSender не запущен, уведомление потеряно")
+            return
+        try:
+            self._queue.put_nowait((chat_id, text, kwargs))
+        except asyncio.QueueFull:
+            self.failed += 1
+            logger.error(f"Очередь уведомлений переполнена, сообщение для {chat_id} отброшено")
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self):
+        # Контекст задачи воркера: все его запросы — фоновые
+        outbound_priority.set(LOW)
+        while True:
+            chat_id, text, kwargs = await self._queue.get()
+            try:
+                await self._deliver(chat_id, text, kwargs)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id, text, kwargs):
+        try:
+            await self._bot.send_message(chat_id, text, **kwargs)
+            self.sent += 1
+        except TelegramForbiddenError as e:
+            self.failed += 1
+            logger.info(f"Уведомление не доставлено {chat_id} (бот заблокирован): {e}")
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Уведомление не доставлено {chat_id}: {e}")
+
+
+notifier = NotificationSender()
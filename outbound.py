@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# --- ПЛАНИРОВЩИК ИСХОДЯЩИХ ЗАПРОСОВ ---
+# Middleware сессии бота: все отправки/правки/удаления проходят через общий лимит
+# Bot API (~30 сообщений/с на бота) и лимит на чат (~1/с в личке, ~20/мин в группе).
+# Ответы пользователю идут в приоритетной полосе; фоновые рассылки (штрафы,
+# уведомления владельцам) — в низкой и пропускают интерактив вперед.
+# RetryAfter ставит паузу и повторяет запрос, до обработчиков он не доходит.
+
+HIGH = 0
+LOW = 1
+LANE_NAMES = {HIGH: 'interactive', LOW: 'background'}
+
+GLOBAL_RATE = 28            # запросов в секунду на бота (с запасом от 30)
+PRIVATE_CHAT_RATE = 1       # сообщений в секунду в личный чат
+PRIVATE_CHAT_BURST = 3      # удалить старое + отправить новое укладываются без ожидания
+GROUP_CHAT_RATE = 20 / 60   # сообщений в секунду в группу/канал
+MAX_RETRY_AFTER_ATTEMPTS = 3
+
+# Методы, на которые распространяются лимиты (остальные — get*, answerCallbackQuery и т.п. — без очереди)
+THROTTLED_PREFIXES = ('Send', 'Edit', 'Delete', 'Copy', 'Forward')
+# Лимит на чат считают только сообщения, удаления его не тратят
+PER_CHAT_PREFIXES = ('Send', 'Edit', 'Copy', 'Forward')
+
+# Полоса текущей задачи. По умолчанию — интерактив (обработчики апдейтов)
+outbound_priority = ContextVar('outbound_priority', default=HIGH)
+
+
+@contextmanager
+def background_priority():
+    """Запросы внутри блока идут в низкой полосе."""
+    token = outbound_priority.set(LOW)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+
+class PriorityRateLimiter:
+    """Token bucket с очередью ожидающих по полосам: токен всегда достается HIGH раньше LOW."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = {HIGH: deque(), LOW: deque()}
+        self._pump_task = None
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def waiting(self, lane):
+        return sum(1 for future in self._waiters[lane] if not future.done())
+
+    async def acquire(self, lane=HIGH):
+        now = time.monotonic()
+        if not any(self._waiters.values()) and now >= self._paused_until:
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(future)
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    def _next_waiter(self):
+        for lane in (HIGH, LOW):
+            waiters = self._waiters[lane]
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    return future
+        return None
+
+    async def _pump(self):
+        while any(self._waiters.values()):
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            future = self._next_waiter()
+            if future is None:
+                return
+            self._tokens -= 1
+            future.set_result(None)
+
+    def pause(self, seconds):
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(self):
+        self._global = PriorityRateLimiter(GLOBAL_RATE)
+        # chat_id -> PriorityRateLimiter: и в очереди одного чата ответ пользователю
+        # обгоняет фоновые сообщения тому же чату
+        self._chats = TTLCache(ttl=600, maxsize=100000)
+        self._wait_total = {HIGH: 0.0, LOW: 0.0}
+        self._wait_max = {HIGH: 0.0, LOW: 0.0}
+        self._requests = {HIGH: 0, LOW: 0}
+        self.retry_after = 0
+
+    def share(self, processes):
+        """Лимит Bot API общий на токен — делим его между процессами бота (до первых запросов)."""
+        rate = GLOBAL_RATE / max(1, processes)
+        self._global = PriorityRateLimiter(rate, capacity=max(1, rate))
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = PriorityRateLimiter(PRIVATE_CHAT_RATE, capacity=PRIVATE_CHAT_BURST)
+            else:
+                bucket = PriorityRateLimiter(GROUP_CHAT_RATE, capacity=1)
+        # Каждое обращение продлевает жизнь бакета в кэше
+        self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def _wait_turn(self, name, chat_id, lane):
+        started = time.monotonic()
+        # Сначала лимит чата, потом глобальный: ожидание одного чата не держит общий токен
+        if chat_id is not None and name.startswith(PER_CHAT_PREFIXES):
+            await self._chat_bucket(chat_id).acquire(lane)
+        await self._global.acquire(lane)
+        waited = time.monotonic() - started
+        self._requests[lane] += 1
+        self._wait_total[lane] += waited
+        self._wait_max[lane] = max(self._wait_max[lane], waited)
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        if not name.startswith(THROTTLED_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, 'chat_id', None)
+        lane = outbound_priority.get()
+        attempt = 0
+        while True:
+            await self._wait_turn(name, chat_id, lane)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.retry_after += 1
+                logger.warning(f"RetryAfter {e.retry_after}с на {name} (чат {chat_id}), попытка {attempt}")
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                else:
+                    self._global.pause(e.retry_after)
+                if attempt >= MAX_RETRY_AFTER_ATTEMPTS:
+                    raise
+
+    def stats(self):
+        """Глубина очередей и ожидание по полосам — для /monitor."""
+        return {
+            LANE_NAMES[lane]: {
+                'queued': self._global.waiting(lane),
+                'requests': self._requests[lane],
+                'avg_wait': self._wait_total[lane] / self._requests[lane] if self._requests[lane] else 0.0,
+                'max_wait': self._wait_max[lane],
+            }
+            for lane in (HIGH, LOW)
+        }
+
+
+outbound = OutboundScheduler()
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+# --- КУРСОРЫ ДЛЯ KEYSET-ПАГИНАЦИИ ---
+# Курсор передается в callback_data кнопок "⬅️/➡️" (лимит Telegram — 64 байта),
+# поэтому он компактный: "<направление>:<ключ>:<ключ>...".
+#   a — строки строго ПОСЛЕ ключа (следующая страница)
+#   b — строки строго ДО ключа (предыдущая страница)
+#   s — строки начиная С ключа включительно (перерисовка текущей страницы)
+# Ключ списка заработка: (price_per_sub, created_at, id), "Моих заданий": (created_at, id).
+
+AFTER = "a"
+BEFORE = "b"
+START = "s"
+
+_EPOCH = datetime(1970, 1, 1)
+_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _to_base36(number):
+    if number == 0:
+        return "0"
+    sign = "-" if number < 0 else ""
+    number = abs(number)
+    digits = []
+    while number:
+        number, rem = divmod(number, 36)
+        digits.append(_ALPHABET[rem])
+    return sign + "".join(reversed(digits))
+
+
+def _encode_ts(dt):
+    return _to_base36((dt - _EPOCH) // timedelta(microseconds=1))
+
+
+def _decode_ts(value):
+    return _EPOCH + timedelta(microseconds=int(value, 36))
+
+
+def task_key(task, mode="earn"):
+    """Ключ сортировки строки задания для выбранного списка."""
+    if mode == "earn":
+        return (Decimal(task['price_per_sub']), task['created_at'], task['id'])
+    return (task['created_at'], task['id'])
+
+
+def encode_cursor(direction, key):
+    parts = [direction]
+    if len(key) == 3:
+        price, created_at, task_id = key
+        parts.append(format(Decimal(price).normalize(), 'f'))
+    else:
+        created_at, task_id = key
+    parts.append(_encode_ts(created_at))
+    parts.append(_to_base36(task_id))
+    return ":".join(parts)
+
+
+def decode_cursor(cursor):
+    """Возвращает (направление, ключ) или (None, None) для первой страницы / битого курсора."""
+    if not cursor:
+        return None, None
+    try:
+        parts = cursor.split(":")
+        direction = parts[0]
+        if direction not in (AFTER, BEFORE, START):
+            return None, None
+        if len(parts) == 4:
+            key = (Decimal(parts[1]), _decode_ts(parts[2]), int(parts[3], 36))
+        elif len(parts) == 3:
+            key = (_decode_ts(parts[1]), int(parts[2], 36))
+        else:
+            return None, None
+        return direction, key
+    except Exception:
+        return None, None
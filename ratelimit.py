@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+# --- ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ К BOT API ---
+
+class TokenBucket:
+    """
+    Token bucket: в среднем rate запросов в секунду, всплески до capacity.
+    pause() останавливает выдачу токенов целиком — так реагируем на RetryAfter,
+    чтобы все воркеры разом подождали, а не продолжали получать 429.
+    Рассчитан на один event loop.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # Lock выстраивает ожидающих в очередь (FIFO), токены не достаются "самому быстрому"
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        # После паузы начинаем с пустого ведра, без залпа накопленных токенов
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+    @property
+    def paused_for(self):
+        return max(0.0, self._paused_until - time.monotonic())
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import time
+from aiogram import Bot
+import database
+from database import db_get_global_stats
+
+logger = logging.getLogger(__name__)
+
+# --- ПРОГРЕВ ПРИ СТАРТЕ ---
+# Все, что не меняется за время жизни процесса (данные бота, ссылки "добавить
+# бота в канал/группу"), получаем один раз до приема апдейтов. ready = True
+# только после прогрева — по нему ориентируется проверка готовности.
+
+GROUP_ADMIN_RIGHTS = "invite_users+change_info+delete_messages"
+CHANNEL_ADMIN_RIGHTS = "post_messages+edit_messages+invite_users+change_info"
+
+
+class Runtime:
+    def __init__(self):
+        self.ready = False
+        self.me = None
+        self.add_to_group_url = None
+        self.add_to_channel_url = None
+
+    async def identity(self, bot: Bot):
+        """Данные бота (get_me) — запрашиваются один раз за жизнь процесса."""
+        if self.me is None:
+            self.me = await bot.get_me()
+            username = self.me.username
+            self.add_to_group_url = f"https://t.me/{username}?startgroup&admin={GROUP_ADMIN_RIGHTS}"
+            self.add_to_channel_url = f"https://t.me/{username}?startchannel&admin={CHANNEL_ADMIN_RIGHTS}"
+        return self.me
+
+    async def warm_up(self, bot: Bot):
+        """Вызывается после init_db и до start_polling."""
+        started = time.monotonic()
+        await self.identity(bot)
+
+        # Пул уже открыл min_size соединений (init-хук подготовил в них запросы);
+        # проверяем их и заодно заполняем кэш статистики для первого /start
+        pool = database.db_pool
+        if pool is not None:
+            async def ping():
+                async with pool.acquire() as conn:
+                    await conn.fetchval("SELECT 1")
+            # Одновременные acquire — каждый пинг на своем соединении
+            await asyncio.gather(*(ping() for _ in range(pool.get_min_size())))
+            await db_get_global_stats()
+
+        self.ready = True
+        logger.info(f"Прогрев завершен за {time.monotonic() - started:.2f} с (@{self.me.username})")
+
+
+runtime = Runtime()
@@ -0,0 +1,354 @@
+import logging
+import asyncpg
+from config import UNSUB_CHECK_DAYS
+
+logger = logging.getLogger(__name__)
+
+# --- РЕЕСТР ПОДГОТОВЛЕННЫХ ЗАПРОСОВ ---
+# Все горячие запросы бота. Каждое новое соединение пула готовит их заранее
+# (init-хук пула), поэтому в обработчиках нет затрат на разбор и планирование SQL.
+# Хелперы в database.py обращаются к ним по имени: conn.stmt('user_get').
+
+_TASKS_PAGE_BASE = '''
+    SELECT id, channel_link, channel_title, price_per_sub, task_type, created_at
+    FROM tasks
+    WHERE active = TRUE
+    AND paused = FALSE
+    AND task_type = $2
+    AND count_done < count_needed
+    AND owner_id != $1
+    AND id NOT IN (SELECT task_id FROM completed WHERE user_id = $1)
+'''
+
+_MY_TASKS_PAGE_BASE = '''
+    SELECT id, channel_link, channel_title, task_type, price_per_sub, count_needed, count_done, active, paused, created_at,
+           (SELECT COUNT(*) FROM tasks WHERE owner_id = $1) AS total_count
+    FROM tasks WHERE owner_id = $1
+'''
+
+STATEMENTS = {
+    # --- Пользователи и баланс ---
+    # DO UPDATE (а не DO NOTHING), чтобы RETURNING отдавал строку и для существующих
+    # Существующий пользователь только читается: ON CONFLICT DO NOTHING не пишет строку
+    'user_get': '''
+        WITH inserted AS (
+            INSERT INTO users (user_id) VALUES ($1)
+            ON CONFLICT (user_id) DO NOTHING
+            RETURNING balance, earned_balance
+        )
+        SELECT balance, earned_balance FROM inserted
+        UNION ALL
+        SELECT balance, earned_balance FROM users
+        WHERE user_id = $1 AND NOT EXISTS (SELECT 1 FROM inserted)
+    ''',
+    # Время последнего визита (ActivityMiddleware, не чаще раза в час на пользователя)
+    'user_touch': "UPDATE users SET last_seen_at = NOW() WHERE user_id = $1",
+    'user_balance_for_update': "SELECT balance, earned_balance FROM users WHERE user_id = $1 FOR UPDATE",
+    'user_insert': "INSERT INTO users (user_id) VALUES ($1)",
+    'user_add_balance': '''
+        UPDATE users SET balance = balance + $1 WHERE user_id = $2
+        RETURNING balance, earned_balance
+    ''',
+    'user_add_earned': '''
+        UPDATE users SET earned_balance = earned_balance + $1 WHERE user_id = $2
+        RETURNING balance, earned_balance
+    ''',
+    'transaction_insert': "INSERT INTO transactions (user_id, amount, type, description) VALUES ($1, $2, $3, $4)",
+
+    # --- Статистика ---
+    # Счетчики разложены по шардам (миграция 17), итог — сумма
+    'global_stats': '''
+        SELECT
+            COALESCE((SELECT SUM(value) FROM bot_stats WHERE key = 'users'), 0) AS users_count,
+            COALESCE((SELECT SUM(completed) FROM bot_stats_daily WHERE day = CURRENT_DATE), 0) AS tasks_today
+    ''',
+
+    # --- Задания ---
+    'purchase_task': "SELECT * FROM purchase_task($1, $2, $3, $4, $5, $6, $7)",
+    'task_by_id': '''
+        SELECT id, owner_id, channel_link, channel_title, task_type, price_per_sub, chat_id, paused
+        FROM tasks WHERE id = $1
+    ''',
+    'complete_task': "SELECT * FROM complete_task($1, $2)",
+    'available_counts': '''
+        SELECT
+            COUNT(*) FILTER (WHERE task_type = 'channel') AS channels,
+            COUNT(*) FILTER (WHERE task_type = 'group') AS groups,
+            COUNT(*) FILTER (WHERE task_type = 'view') AS views,
+            COUNT(*) FILTER (WHERE task_type = 'reaction') AS reactions,
+            COUNT(*) FILTER (WHERE task_type = 'bot') AS bots
+        FROM tasks
+        WHERE active = TRUE
+        AND paused = FALSE
+        AND count_done < count_needed
+        AND owner_id != $1
+        AND id NOT IN (SELECT task_id FROM completed WHERE user_id = $1)
+    ''',
+    'completed_ids': "SELECT task_id FROM completed WHERE user_id = $1 ORDER BY task_id",
+
+    # Keyset-страницы "💰 Заработать": первая / после курсора / с курсора / до курсора
+    'tasks_page_first': _TASKS_PAGE_BASE + '''
+        ORDER BY price_per_sub DESC, created_at DESC, id DESC
+        LIMIT $3
+    ''',
+    'tasks_page_after': _TASKS_PAGE_BASE + '''
+        AND (price_per_sub, created_at, id) < ($4, $5, $6)
+        ORDER BY price_per_sub DESC, created_at DESC, id DESC
+        LIMIT $3
+    ''',
+    'tasks_page_start': _TASKS_PAGE_BASE + '''
+        AND (price_per_sub, created_at, id) <= ($4, $5, $6)
+        ORDER BY price_per_sub DESC, created_at DESC, id DESC
+        LIMIT $3
+    ''',
+    'tasks_page_before': _TASKS_PAGE_BASE + '''
+        AND (price_per_sub, created_at, id) > ($4, $5, $6)
+        ORDER BY price_per_sub ASC, created_at ASC, id ASC
+        LIMIT $3
+    ''',
+
+    # Keyset-страницы "📂 Мои задания"
+    'my_tasks_page_first': _MY_TASKS_PAGE_BASE + '''
+        ORDER BY created_at DESC, id DESC
+        LIMIT $2
+    ''',
+    'my_tasks_page_after': _MY_TASKS_PAGE_BASE + '''
+        AND (created_at, id) < ($3, $4)
+        ORDER BY created_at DESC, id DESC
+        LIMIT $2
+    ''',
+    'my_tasks_page_start': _MY_TASKS_PAGE_BASE + '''
+        AND (created_at, id) <= ($3, $4)
+        ORDER BY created_at DESC, id DESC
+        LIMIT $2
+    ''',
+    'my_tasks_page_before': _MY_TASKS_PAGE_BASE + '''
+        AND (created_at, id) > ($3, $4)
+        ORDER BY created_at ASC, id ASC
+        LIMIT $2
+    ''',
+
+    # --- Подписки, штрафы, мониторинг ---
+    'subscription_penalized': "SELECT penalized FROM subscriptions WHERE user_id = $1 AND task_id = $2",
+    # Пачка штрафов одним запросом: флаг, списание и запись в журнал вместе.
+    # Флаг ставится только один раз (выход ловят и апдейты, и мониторинг),
+    # штраф снимает подписку с очереди проверок
+    'subscriptions_penalize_batch': '''
+        WITH input AS (
+            SELECT * FROM unnest($1::bigint[], $2::int[], $3::numeric[], $4::text[])
+                AS u(user_id, task_id, amount, title)
+        ),
+        flagged AS (
+            UPDATE subscriptions s SET penalized = TRUE, next_check_at = NULL,
+                lease_owner = NULL, lease_until = NULL
+            FROM input i
+            WHERE s.user_id = i.user_id AND s.task_id = i.task_id AND s.penalized = FALSE
+            RETURNING s.user_id, s.task_id, i.amount, i.title
+        ),
+        debited AS (
+            UPDATE users u SET earned_balance = u.earned_balance - d.total
+            FROM (SELECT user_id, SUM(amount) AS total FROM flagged GROUP BY user_id) d
+            WHERE u.user_id = d.user_id
+            RETURNING u.user_id, u.balance, u.earned_balance
+        ),
+        ledger AS (
+            INSERT INTO transactions (user_id, amount, type, description)
+            SELECT user_id, -amount, 'penalty', 'Штраф за отписку: ' || title FROM flagged
+        )
+        SELECT f.user_id, f.task_id, d.balance, d.earned_balance
+        FROM flagged f JOIN debited d ON d.user_id = f.user_id
+    ''',
+    # После возврата штрафа подписка снова проверяется, если срок еще не вышел
+    'subscription_unpenalize': f'''
+        UPDATE subscriptions SET penalized = FALSE,
+            next_check_at = CASE
+                WHEN subscribed_at > LOCALTIMESTAMP - INTERVAL '{UNSUB_CHECK_DAYS} days'
+                THEN LOCALTIMESTAMP + INTERVAL '1 minute'
+            END
+        WHERE user_id = $1 AND task_id = $2
+    ''',
+    # Очередь мониторинга: воркер $2 берет в аренду на $3 секунд до $1 подписок,
+    # срок проверки которых наступил. Строки, занятые другим воркером, пропускаются
+    'subscriptions_lease': '''
+        WITH due AS (
+            SELECT s.user_id, s.task_id
+            FROM subscriptions s
+            JOIN tasks t ON s.task_id = t.id
+            WHERE s.next_check_at <= LOCALTIMESTAMP
+            AND (s.lease_until IS NULL OR s.lease_until < LOCALTIMESTAMP)
+            AND t.paused = FALSE
+            AND s.penalized = FALSE
+            AND s.rewarded = TRUE
+            ORDER BY s.next_check_at
+            LIMIT $1
+            FOR UPDATE OF s SKIP LOCKED
+        )
+        UPDATE subscriptions s
+        SET lease_owner = $2, lease_until = LOCALTIMESTAMP + $3::int * INTERVAL '1 second'
+        FROM due, tasks t
+        WHERE s.user_id = due.user_id AND s.task_id = due.task_id AND t.id = s.task_id
+        RETURNING s.user_id, s.task_id, s.subscribed_at, s.next_check_at, LOCALTIMESTAMP AS db_now,
+                  t.channel_link, t.channel_title, t.price_per_sub, t.task_type, t.member_event_at, t.chat_id
+    ''',
+    # Перенос проверки снимает аренду; строки, аренда которых истекла и перешла
+    # к другому воркеру ($4 — наш lease_owner), не трогаем. Подписку задания,
+    # поставленного на паузу во время проверки, оставляем вне очереди
+    'subscriptions_reschedule': '''
+        UPDATE subscriptions s
+        SET next_check_at = CASE
+                WHEN s.next_check_at = 'infinity' AND u.next_check_at IS NOT NULL THEN s.next_check_at
+                ELSE u.next_check_at
+            END,
+            checked_at = LOCALTIMESTAMP,
+            lease_owner = NULL, lease_until = NULL
+        FROM unnest($1::bigint[], $2::int[], $3::timestamp[]) AS u(user_id, task_id, next_check_at)
+        WHERE s.user_id = u.user_id AND s.task_id = u.task_id AND s.lease_owner = $4
+    ''',
+    # Подписки юзера на чат, которые еще под мониторингом (для апдейта "вышел из чата").
+    # Чат ищем по chat_id, у старых заданий без chat_id — по юзернейму из ссылки
+    'subscriptions_for_chat_member': f'''
+        SELECT s.user_id, s.task_id, t.channel_link, t.channel_title, t.price_per_sub
+        FROM subscriptions s
+        JOIN tasks t ON s.task_id = t.id
+        WHERE s.user_id = $1
+        AND (t.chat_id = $2 OR (t.chat_id IS NULL AND chat_key(t.channel_link) = $3))
+        AND t.task_type IN ('channel', 'group')
+        AND s.penalized = FALSE
+        AND s.rewarded = TRUE
+        AND s.subscribed_at > LOCALTIMESTAMP - INTERVAL '{UNSUB_CHECK_DAYS} days'
+    ''',
+    'tasks_mark_member_event': '''
+        UPDATE tasks SET member_event_at = LOCALTIMESTAMP
+        WHERE chat_id = $1 OR (chat_id IS NULL AND chat_key(channel_link) = $2)
+    ''',
+    # Пауза/возобновление заданий чата (chat_health): по chat_id или юзернейму
+    # Подписки приостановленных заданий уходят из очереди (next_check_at = infinity):
+    # иначе subscriptions_lease на каждом проходе заново пролистывал бы их по
+    # idx_subscriptions_due. При возобновлении они сразу становятся due
+    'tasks_pause_chat': '''
+        WITH paused AS (
+            UPDATE tasks SET paused = TRUE
+            WHERE (chat_id = $1 OR (chat_id IS NULL AND chat_key(channel_link) = $2))
+            AND task_type IN ('channel', 'group')
+            AND paused = FALSE
+            RETURNING id, owner_id, channel_title, (active AND count_done < count_needed) AS is_open
+        ), parked AS (
+            UPDATE subscriptions s SET next_check_at = 'infinity'
+            FROM paused p
+            WHERE s.task_id = p.id AND s.next_check_at IS NOT NULL
+        )
+        SELECT id, owner_id, channel_title, is_open FROM paused
+    ''',
+    'tasks_resume_chat': '''
+        WITH resumed AS (
+            UPDATE tasks SET paused = FALSE
+            WHERE (chat_id = $1 OR (chat_id IS NULL AND chat_key(channel_link) = $2))
+            AND paused = TRUE
+            RETURNING id
+        ), unparked AS (
+            UPDATE subscriptions s SET next_check_at = LOCALTIMESTAMP
+            FROM resumed r
+            WHERE s.task_id = r.id AND s.next_check_at = 'infinity'
+        )
+        SELECT id FROM resumed
+    ''',
+    # Старые задания на каналы/группы, созданные до появления tasks.chat_id
+    'tasks_missing_chat_id': '''
+        SELECT DISTINCT chat_key(channel_link) AS chat FROM tasks
+        WHERE chat_id IS NULL AND task_type IN ('channel', 'group')
+        AND chat_key(channel_link) IS NOT NULL
+    ''',
+    'tasks_set_chat_id': '''
+        UPDATE tasks SET chat_id = $1 WHERE chat_id IS NULL AND chat_key(channel_link) = $2
+    ''',
+
+    # --- Платежи ---
+    'invoice_insert': '''
+        INSERT INTO invoices (invoice_id, user_id, amount, payment_type) VALUES ($1, $2, $3, 'stars')
+    ''',
+
+    # --- Проверка скриншотов ---
+    'review_insert': "INSERT INTO pending_reviews (user_id, task_id) VALUES ($1, $2) RETURNING id",
+    'review_get': "SELECT user_id, task_id FROM pending_reviews WHERE id = $1",
+    'review_delete': "DELETE FROM pending_reviews WHERE id = $1",
+
+    # --- Рассылки ---
+    'broadcast_create': '''
+        INSERT INTO broadcasts (admin_id, audience, audience_days, text, total, owner)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        RETURNING *
+    ''',
+    # Рассылки, которые никто не ведет: владелец не писал чекпоинт $2 секунд
+    'broadcast_claim_stale': '''
+        UPDATE broadcasts SET owner = $1, updated_at = NOW()
+        WHERE status = 'running' AND updated_at < NOW() - $2::int * INTERVAL '1 second'
+        RETURNING *
+    ''',
+    # Чекпоинт пишет только текущий владелец; NULL — рассылку подхватил другой процесс
+    'broadcast_checkpoint': '''
+        UPDATE broadcasts
+        SET last_user_id = $3, sent = sent + $4, failed = failed + $5, blocked = blocked + $6,
+            status = CASE WHEN $7 AND status = 'running' THEN 'done' ELSE status END,
+            updated_at = NOW()
+        WHERE id = $1 AND owner = $2
+        RETURNING status
+    ''',
+    'broadcast_cancel': '''
+        UPDATE broadcasts SET status = 'cancelled', updated_at = NOW()
+        WHERE id = $1 AND status = 'running'
+        RETURNING id
+    ''',
+    'users_mark_blocked': '''
+        INSERT INTO blocked_users (user_id) SELECT unnest($1::bigint[])
+        ON CONFLICT (user_id) DO UPDATE SET blocked_at = NOW()
+    ''',
+}
+
+# Аудитории рассылки: имя -> условие на users u. {days} — номер параметра "N дней"
+BROADCAST_AUDIENCES = {
+    'all': 'TRUE',
+    'earned': 'u.earned_balance > 0',
+    'active': "u.last_seen_at > NOW() - make_interval(days => {days}::int)",
+}
+
+_BROADCAST_FILTER = '''
+    NOT EXISTS (
+        SELECT 1 FROM blocked_users b
+        WHERE b.user_id = u.user_id AND b.blocked_at >= u.last_seen_at
+    )
+    AND ({predicate})
+'''
+
+for _audience, _predicate in BROADCAST_AUDIENCES.items():
+    # $1 — чекпоинт (последний обработанный user_id), $2 — размер пачки, $3 — дни
+    STATEMENTS[f'broadcast_recipients_{_audience}'] = f'''
+        SELECT u.user_id FROM users u
+        WHERE u.user_id > $1 AND {_BROADCAST_FILTER.format(predicate=_predicate.format(days='$3'))}
+        ORDER BY u.user_id
+        LIMIT $2
+    '''
+    STATEMENTS[f'broadcast_count_{_audience}'] = f'''
+        SELECT COUNT(*) FROM users u
+        WHERE {_BROADCAST_FILTER.format(predicate=_predicate.format(days='$1'))}
+    '''
+
+
+class BotConnection(asyncpg.Connection):
+    """Соединение пула с заранее подготовленными запросами из STATEMENTS."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._statements = {}
+
+    async def prepare_registry(self):
+        for name, query in STATEMENTS.items():
+            self._statements[name] = await self.prepare(query)
+
+    def stmt(self, name):
+        return self._statements[name]
+
+
+async def init_connection(conn):
+    """init-хук пула: соединение получает трафик только после подготовки всех запросов."""
+    await conn.prepare_registry()
+    logger.debug(f"Соединение БД прогрето ({len(STATEMENTS)} запросов)")
@@ -1,42 +1,107 @@
 import logging
 import asyncio
+import hashlib
 from aiogram import Bot
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message
+from aiogram.types import Message, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from aiogram.exceptions import TelegramBadRequest
 from keyboards import main_kb
+from cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Чаты, где постоянная клавиатура main_kb точно показана (chat_id -> True).
+# Нет записи (новый чат, рестарт, истек TTL) — клавиатуру восстанавливаем один раз.
+_keyboard_shown = TTLCache(ttl=6 * 3600, maxsize=100000)
+# Ссылки на фоновые задачи восстановления, чтобы их не собрал GC
+_restore_tasks = set()
+
+# Сообщения, которые уже удалены или удалить нельзя (chat_id -> set(message_id)):
+# их повторно не трогаем. Id с временной ошибкой сюда не попадают
+_stale_msg_ids = TTLCache(ttl=3600, maxsize=100000)
+
+DELETE_CHUNK = 100  # лимит deleteMessages
+# Ответы deleteMessages, после которых id не пробуем удалить снова
+FINAL_DELETE_ERRORS = ("message to delete not found", "message can't be deleted")
+
+def note_reply_markup(chat_id: int, reply_markup):
+    """Запоминает, какая reply-клавиатура теперь у чата (inline-разметка ее не меняет)."""
+    if reply_markup is main_kb:
+        _keyboard_shown.set(chat_id, True)
+    elif isinstance(reply_markup, (ReplyKeyboardMarkup, ReplyKeyboardRemove)):
+        _keyboard_shown.pop(chat_id)
+
 # --- UI HELPERS ---
 
-async def delete_old_messages(chat_id: int, state: FSMContext, bot: Bot):
-    """
-    Удаляет все сообщения бота, ID которых сохранены в состоянии.
-    """
-    data = await state.get_data()
+def _render_hash(text, reply_markup, parse_mode):
+    """Отпечаток того, что увидит пользователь: текст + разметка."""
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else ""
+    return hashlib.sha1(f"{parse_mode}\x00{text}\x00{markup}".encode()).hexdigest()[:16]
+
+def _stored_msg_ids(data):
     msg_ids = data.get('bot_msg_ids', [])
     if isinstance(msg_ids, int):
         msg_ids = [msg_ids]
-    
+    return msg_ids
+
+def _is_final_delete_error(error):
+    """Ошибки, после которых повторять удаление бессмысленно (уже удалено, старше 48 ч)."""
+    message = str(error).lower()
+    return isinstance(error, TelegramBadRequest) and any(text in message for text in FINAL_DELETE_ERRORS)
+
+async def _delete_messages(chat_id: int, msg_ids, bot: Bot):
+    """
+    Удаляет сообщения пачками deleteMessages. Удаленные и неудаляемые id больше не трогаем;
+    id пачек с временной ошибкой (RetryAfter, сеть) возвращаются для следующей очистки.
+    """
+    stale = _stale_msg_ids.get(chat_id)
+    if stale is None:
+        stale = set()
+        _stale_msg_ids.set(chat_id, stale)
+    msg_ids = [msg_id for msg_id in msg_ids if msg_id not in stale]
     if not msg_ids:
-        return
+        return []
+    # Сразу помечаем, чтобы параллельная очистка не удаляла те же сообщения
+    stale.update(msg_ids)
 
-    for msg_id in msg_ids:
+    async def delete_chunk(chunk):
         try:
-            await bot.delete_message(chat_id=chat_id, message_id=msg_id)
-        except Exception:
-            pass
-            
-    # Очищаем список в состоянии, но не сохраняем пока
+            await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+        except Exception as e:
+            logger.debug(f"Could not delete messages {chunk} in {chat_id}: {e}")
+            if not _is_final_delete_error(e):
+                stale.difference_update(chunk)
+                return chunk
+        return []
+
+    chunks = [msg_ids[i:i + DELETE_CHUNK] for i in range(0, len(msg_ids), DELETE_CHUNK)]
+    results = await asyncio.gather(*(delete_chunk(chunk) for chunk in chunks))
+    return [msg_id for chunk in results for msg_id in chunk]
+
+async def delete_old_messages(chat_id: int, state: FSMContext, bot: Bot):
+    """
+    Удаляет все сообщения бота, ID которых сохранены в состоянии.
+    """
+    data = await state.get_data()
+    await _delete_messages(chat_id, _stored_msg_ids(data), bot)
+
+async def reset_state(state: FSMContext):
+    """
+    state.clear(), но ID сообщений бота сохраняются: их удалит следующий
+    send_clean_message одновременно с отправкой нового сообщения.
+    """
+    data = await state.get_data()
+    await state.set_state(None)
+    await state.set_data({'bot_msg_ids': _stored_msg_ids(data), 'last_render': data.get('last_render')})
 
 async def send_clean_message(message: Message, state: FSMContext, bot: Bot, text: str, reply_markup=None, parse_mode="HTML"):
     """
-    1. Удаляет ВСЕ старые сообщения бота.
+    1. Удаляет ВСЕ старые сообщения бота (одновременно с отправкой нового).
     2. Отправляет НОВОЕ сообщение.
     3. Сохраняет ID нового сообщения в список.
     """
-    await delete_old_messages(message.chat.id, state, bot)
+    data = await state.get_data()
+    cleanup = asyncio.create_task(_delete_messages(message.chat.id, _stored_msg_ids(data), bot))
 
     if reply_markup is None:
         reply_markup = main_kb
@@ -48,11 +113,19 @@ async def send_clean_message(message: Message, state: FSMContext, bot: Bot, text
             parse_mode=parse_mode, 
             disable_web_page_preview=True
         )
-        await state.update_data(bot_msg_ids=[new_msg.message_id])
+        note_reply_markup(message.chat.id, reply_markup)
+        # Не удаленные из-за временной ошибки сообщения удалит следующая очистка
+        leftover = await cleanup
+        await state.update_data(
+            bot_msg_ids=leftover + [new_msg.message_id],
+            last_render=[new_msg.message_id, _render_hash(text, reply_markup, parse_mode)]
+        )
         return new_msg
     except Exception as e:
         logger.error(f"Error sending message: {e}")
         return None
+    finally:
+        await cleanup
 
 async def restore_keyboard(chat_id: int, bot: Bot):
     """
@@ -67,6 +140,7 @@ async def restore_keyboard(chat_id: int, bot: Bot):
             text="\u200b",  # Невидимый символ (zero-width space)
             reply_markup=main_kb
         )
+        note_reply_markup(chat_id, main_kb)
         # Небольшая задержка, чтобы Telegram успел показать клавиатуру
         await asyncio.sleep(0.2)
         # Удаляем сообщение, но клавиатура остается видимой благодаря is_persistent=True
@@ -75,14 +149,34 @@ async def restore_keyboard(chat_id: int, bot: Bot):
         except:
             pass
     except Exception as e:
+        _keyboard_shown.pop(chat_id)
         logger.debug(f"Could not restore keyboard: {e}")
 
+def ensure_keyboard(chat_id: int, bot: Bot):
+    """
+    Восстанавливает reply keyboard, только если она могла пропасть.
+    Не ждет: восстановление идет фоновой задачей, ответ пользователю не задерживается.
+    """
+    if _keyboard_shown.get(chat_id):
+        return
+    # Отмечаем сразу, чтобы частые нажатия не запускали восстановление повторно
+    _keyboard_shown.set(chat_id, True)
+    task = asyncio.create_task(restore_keyboard(chat_id, bot))
+    _restore_tasks.add(task)
+    task.add_done_callback(_restore_tasks.discard)
+
 async def safe_edit_message(message: Message, state: FSMContext, bot: Bot, text: str, reply_markup=None, parse_mode="HTML"):
     """
     Пытается отредактировать сообщение. 
+    Если содержимое не изменилось (повторное нажатие) — ничего не делает.
     Если не получается — удаляет всё и шлет новое.
-    После редактирования всегда восстанавливает reply keyboard.
+    После редактирования восстанавливает reply keyboard, если она могла пропасть.
     """
+    render = [message.message_id, _render_hash(text, reply_markup, parse_mode)]
+    data = await state.get_data()
+    if data.get('last_render') == render:
+        return True
+
     try:
         await message.edit_text(
             text=text,
@@ -90,11 +184,15 @@ async def safe_edit_message(message: Message, state: FSMContext, bot: Bot, text:
             parse_mode=parse_mode,
             disable_web_page_preview=True
         )
-        await state.update_data(bot_msg_ids=[message.message_id])
-        # Всегда восстанавливаем reply keyboard после редактирования inline-сообщения
-        await restore_keyboard(message.chat.id, bot)
+        await state.update_data(bot_msg_ids=[message.message_id], last_render=render)
+        # Reply keyboard могла пропасть — вернем ее в фоне (обычно не нужно)
+        ensure_keyboard(message.chat.id, bot)
         return True
-    except TelegramBadRequest:
+    except TelegramBadRequest as e:
+        # То же содержимое уже на экране (отпечатка не было, например после рестарта)
+        if "message is not modified" in str(e).lower():
+            await state.update_data(bot_msg_ids=[message.message_id], last_render=render)
+            return True
         await send_clean_message(message, state, bot, text, reply_markup, parse_mode)
         return False
     except Exception as e:
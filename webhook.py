@@ -0,0 +1,86 @@
+import asyncio
+import hmac
+import logging
+import os
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+import database
+from config import WEBHOOK_PATH, WEBHOOK_SECRET
+from runtime import runtime
+
+logger = logging.getLogger(__name__)
+
+# --- ПРИЕМ АПДЕЙТОВ ЧЕРЕЗ WEBHOOK ---
+# Telegram получает 200 сразу, апдейт обрабатывается в фоновой задаче, поэтому
+# медленный обработчик не задерживает доставку следующих. Запрос без верного
+# X-Telegram-Bot-Api-Secret-Token отклоняется (401). При остановке процесс
+# перестает принимать запросы и дожидается уже принятых апдейтов (drain).
+# Локальная проверка — POST сохраненного апдейта:
+#   curl -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+#        -H "Content-Type: application/json" -d @update.json localhost:8080/webhook
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+DRAIN_TIMEOUT = 30  # секунд на обработку принятых апдейтов при остановке
+
+
+class UpdateReceiver:
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self._dp = dp
+        self._bot = bot
+        self._tasks = set()     # апдейты, принятые и еще не обработанные
+
+    async def handle(self, request):
+        secret = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(secret.encode(), WEBHOOK_SECRET.encode()):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({})
+
+    async def _process(self, update):
+        try:
+            await self._dp.feed_raw_update(self._bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        """Дожидается принятых апдейтов (не дольше timeout секунд)."""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"Не обработано апдейтов при остановке: {len(pending)}")
+            for task in pending:
+                task.cancel()
+
+
+async def healthz(request):
+    """200 — процесс прогрет и пул БД открыт; 503 — еще стартует (балансировщику не слать)."""
+    if runtime.ready and database.db_pool is not None:
+        return web.json_response({'status': 'ok', 'pid': os.getpid()})
+    return web.json_response({'status': 'starting', 'pid': os.getpid()}, status=503)
+
+
+def build_app(receiver: UpdateReceiver):
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receiver.handle)
+    app.router.add_get('/healthz', healthz)
+    return app
+
+
+async def serve(app, host, port, reuse_port=False):
+    """Запускает сервер и возвращает runner (для runner.cleanup() при остановке)."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # reuse_port: несколько процессов слушают один порт, ядро раздает им соединения
+    site = web.TCPSite(runner, host, port, reuse_port=reuse_port)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {host}:{port}{WEBHOOK_PATH} (pid {os.getpid()})")
+    return runner